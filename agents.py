@@ -0,0 +1,128 @@
+import numpy as np
+
+
+class AgentStore:
+    """
+    Struct-of-arrays agent state: positions, ids, destination goal ids and an active mask indexed by slot,
+    plus an occupancy grid that is updated incrementally as agents move.
+    Slots keep their order, so the priority of agents never changes; removal only clears the mask.
+    """
+
+    def __init__(self, tile_map, capacity=64):
+        self.static = np.asarray(tile_map, dtype=bool)
+        self.occupancy = np.zeros(self.static.shape, dtype=np.int32)
+        # static obstacles or at least one agent
+        self.blocked = self.static.copy()
+
+        self.positions = np.zeros((capacity, 2), dtype=np.int64)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.goals = np.zeros(capacity, dtype=np.int64)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.size = 0
+        self.next_id = 0
+
+    def __len__(self):
+        return int(np.count_nonzero(self.active[:self.size]))
+
+    def _reserve(self, n):
+        capacity = len(self.positions)
+        if self.size + n <= capacity:
+            return
+        capacity = max(capacity * 2, self.size + n)
+        for name in ('positions', 'ids', 'goals', 'active'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def add(self, positions, goals=0) -> np.ndarray:
+        """
+        :param goals: destination goal id of every new agent, or one for all of them
+        :return: slots of the new agents
+        """
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+        n = len(positions)
+        self._reserve(n)
+        slots = np.arange(self.size, self.size + n)
+        self.positions[slots] = positions
+        self.ids[slots] = np.arange(self.next_id, self.next_id + n)
+        self.goals[slots] = goals
+        self.active[slots] = True
+        self.size += n
+        self.next_id += n
+        np.add.at(self.occupancy, (positions[:, 0], positions[:, 1]), 1)
+        self.blocked[positions[:, 0], positions[:, 1]] = True
+        return slots
+
+    def state(self) -> dict:
+        """
+        :return: arrays of the active agents in slot order, enough to restore() them
+        """
+        slots = self.active_slots()
+        return {'positions': self.positions[slots], 'ids': self.ids[slots], 'goals': self.goals[slots],
+                'next_id': np.array(self.next_id)}
+
+    def restore(self, state):
+        """
+        Adds the agents saved by state(), keeping their ids and order.
+        """
+        slots = self.add(state['positions'], state['goals'])
+        self.ids[slots] = state['ids']
+        self.next_id = int(state['next_id'])
+
+    def set_static(self, tile_map):
+        """
+        New static obstacles, e.g. after a gate opened or closed.
+        """
+        self.static = np.asarray(tile_map, dtype=bool).copy()
+        self.blocked = self.static | (self.occupancy > 0)
+
+    def _leave(self, x, y):
+        self.occupancy[x, y] -= 1
+        if self.occupancy[x, y] == 0:
+            self.blocked[x, y] = self.static[x, y]
+
+    def move(self, slot, x, y):
+        ox, oy = self.positions[slot]
+        if ox == x and oy == y:
+            return
+        if self.static[x, y]:
+            raise ValueError(f'Agent {int(self.ids[slot])} stepped from {(int(ox), int(oy))} '
+                             f'onto the obstacle at {(int(x), int(y))}')
+        self._leave(ox, oy)
+        self.positions[slot] = x, y
+        self.occupancy[x, y] += 1
+        self.blocked[x, y] = True
+
+    def remove(self, slots):
+        """
+        Deactivates agents; slots of the remaining agents may change afterwards (see compact).
+        """
+        for slot in np.atleast_1d(slots):
+            if self.active[slot]:
+                self.active[slot] = False
+                self._leave(*self.positions[slot])
+        if self.size > 64 and len(self) < self.size // 2:
+            self.compact()
+
+    def compact(self):
+        """
+        Drops inactive slots, keeping the order of the active agents.
+        """
+        slots = self.active_slots()
+        n = len(slots)
+        self.positions[:n] = self.positions[slots]
+        self.ids[:n] = self.ids[slots]
+        self.goals[:n] = self.goals[slots]
+        self.active[:n] = True
+        self.active[n:self.size] = False
+        self.size = n
+
+    def active_slots(self) -> np.ndarray:
+        return np.flatnonzero(self.active[:self.size])
+
+    def active_positions(self) -> np.ndarray:
+        return self.positions[self.active_slots()]
+
+    def active_ids(self) -> np.ndarray:
+        return self.ids[self.active_slots()]
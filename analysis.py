@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+
+from os_activities import TrajectoryReader
+from utilities import file_hash
+
+HEATMAPS_VERSION = 2
+
+
+def stack_frames(paths):
+    """
+    :param paths: TrajectoryReader or list of frames, each a list of [x, y]
+    :return: (N, 2) positions of all frames one after another, the (n_frames + 1) row offsets
+    and the (N,) agent ids, None if the trajectory has none (JSON logs)
+    """
+    if isinstance(paths, TrajectoryReader):
+        return (np.asarray(paths.rows['pos'], dtype=np.int64), np.asarray(paths.index, dtype=np.int64),
+                np.asarray(paths.rows['id'], dtype=np.int64))
+
+    lengths = np.fromiter((len(frame) for frame in paths), dtype=np.int64, count=len(paths))
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    positions = np.array([p for frame in paths for p in frame], dtype=np.int64).reshape(-1, 2)
+    return positions, offsets, None
+
+
+def frame_ids(paths, k):
+    """
+    :return: agent ids of frame k, None if the trajectory has none
+    """
+    if isinstance(paths, TrajectoryReader):
+        return paths.ids(k).tolist()
+    return None
+
+
+def previous_rows(offsets, ids=None):
+    """
+    Pairs every row with the row of the same agent in the previous frame.
+    Agents are matched by id; without ids, by their index in the frame.
+    :return: rows that have such a row, and the previous rows
+    """
+    lengths = np.diff(offsets)
+    frame = np.repeat(np.arange(len(lengths)), lengths)
+    if ids is None:
+        index_in_frame = np.arange(len(frame)) - offsets[frame]
+        has_previous = frame > 0
+        has_previous[has_previous] &= index_in_frame[has_previous] < lengths[frame[has_previous] - 1]
+        rows = np.flatnonzero(has_previous)
+        return rows, offsets[frame[rows] - 1] + index_in_frame[rows]
+
+    # One sorted key per (frame, id), looked up for (frame - 1, id)
+    span = int(ids.max()) + 1 if len(ids) else 1
+    keys = frame * span + ids
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    candidates = np.flatnonzero(frame > 0)
+    targets = keys[candidates] - span
+    found = np.minimum(np.searchsorted(sorted_keys, targets), len(sorted_keys) - 1)
+    matched = sorted_keys[found] == targets
+    return candidates[matched], order[found[matched]]
+
+
+def bake_heatmaps(paths, grid_size):
+    """
+    Density and stuck maps of the whole trajectory in one vectorized pass.
+    An agent is stuck when it keeps the cell it had in the previous frame; agents are matched by id
+    where the trajectory has ids, otherwise by index.
+    :return: density map, stuck map, stuck vectors ((x0, y0), (x1, y1)) through the most congested cells
+    """
+    positions, offsets, ids = stack_frames(paths)
+    density_map = np.zeros(grid_size)
+    stuck_map = np.zeros(grid_size)
+    if len(positions) == 0:
+        return density_map, stuck_map, set()
+
+    np.add.at(density_map, (positions[:, 0], positions[:, 1]), 1)
+
+    rows, previous = previous_rows(offsets, ids)
+    stuck = np.all(positions[rows] == positions[previous], axis=1)
+    stuck_rows = rows[stuck]
+    np.add.at(stuck_map, (positions[stuck_rows, 0], positions[stuck_rows, 1]), 1)
+
+    # Movement through the cells where agents get stuck most;
+    # by index, agents only match in frames without arrivals or spawns
+    max_stuck_value = stuck_map.max()
+    selected = stuck_map[positions[rows, 0], positions[rows, 1]] >= max_stuck_value / 2
+    if ids is None:
+        lengths = np.diff(offsets)
+        frame = np.repeat(np.arange(len(lengths)), lengths)
+        selected &= lengths[frame[rows]] == lengths[frame[rows] - 1]
+    stuck_vectors = set(zip(map(tuple, positions[previous[selected]].tolist()),
+                            map(tuple, positions[rows[selected]].tolist())))
+
+    return density_map, stuck_map, stuck_vectors
+
+
+def heatmaps_cache_path(paths_file):
+    directory, name = os.path.split(paths_file)
+    return os.path.join(directory, f'.{name}.heatmaps.npz')
+
+
+def load_heatmaps(paths_file, paths, grid_size):
+    """
+    Baked heatmaps of a simulation, cached next to it and keyed by the simulation file hash.
+    """
+    cache_file = heatmaps_cache_path(paths_file)
+    key = f'{HEATMAPS_VERSION}:{file_hash(paths_file)}:{tuple(grid_size)}'
+
+    if os.path.exists(cache_file):
+        try:
+            with np.load(cache_file) as cached:
+                if str(cached['key']) == key:
+                    stuck_vectors = set((tuple(a), tuple(b)) for a, b in cached['stuck_vectors'].tolist())
+                    return cached['density_map'], cached['stuck_map'], stuck_vectors
+        except (OSError, ValueError, KeyError):
+            pass
+
+    density_map, stuck_map, stuck_vectors = bake_heatmaps(paths, grid_size)
+    vectors = np.array(sorted(stuck_vectors), dtype=np.int64).reshape(-1, 2, 2)
+    tmp_file = cache_file + '.tmp.npz'
+    np.savez_compressed(tmp_file, key=key, density_map=density_map, stuck_map=stuck_map, stuck_vectors=vectors)
+    os.replace(tmp_file, cache_file)
+    return density_map, stuck_map, stuck_vectors
@@ -0,0 +1,235 @@
+"""
+Anytime D* benchmark: the array-backed GridADStar against the original dict-based ADStar
+on generated maps, for the initial anytime search and for repairs after obstacle changes.
+
+    python -m benchmarks.adstar_benchmark [-s 100 500] [-c CHANGES]
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from planning.Star import GridADStar
+
+
+class LegacyADStar:
+    """
+    planning.Star.ADStar as it was before the rewrite, kept for comparison: OPEN is a dict and
+    TopKey scans all of it. Only what the benchmark needs was changed: obstacles are read from a tile map
+    indexed [x][y], neighbours stay on the map and update_cells / replan repair the plan as on_press did.
+    """
+
+    def __init__(self, map, s_start, s_goal, eps, heuristic_type):
+        self.s_start, self.s_goal = s_start, s_goal
+        self.heuristic_type = heuristic_type
+
+        self.u_set = [(-1, 0), (-1, 1), (0, 1), (1, 1),
+                      (1, 0), (1, -1), (0, -1), (-1, -1)]
+        self.obs = set((int(x), int(y)) for x, y in np.argwhere(np.asarray(map)))
+        self.x = len(map)
+        self.y = len(map[0])
+
+        self.g, self.rhs, self.OPEN = {}, {}, {}
+
+        for i in range(self.x):
+            for j in range(self.y):
+                self.rhs[(i, j)] = float("inf")
+                self.g[(i, j)] = float("inf")
+
+        self.rhs[self.s_goal] = 0.0
+        self.eps = eps
+        self.OPEN[self.s_goal] = self.Key(self.s_goal)
+        self.CLOSED, self.INCONS = set(), dict()
+
+    def run(self):
+        self.ComputeOrImprovePath()
+
+        while True:
+            if self.eps <= 1.0:
+                break
+            self.eps -= 0.5
+            self.OPEN.update(self.INCONS)
+            for s in self.OPEN:
+                self.OPEN[s] = self.Key(s)
+            self.CLOSED = set()
+            self.ComputeOrImprovePath()
+
+    def update_cells(self, blocked=(), freed=()):
+        for s in blocked:
+            if s not in self.obs:
+                self.obs.add(s)
+                self.g[s] = float("inf")
+                self.rhs[s] = float("inf")
+                for sn in self.get_neighbor(s):
+                    self.UpdateState(sn)
+        for s in freed:
+            if s in self.obs:
+                self.obs.remove(s)
+                self.UpdateState(s)
+                for sn in self.get_neighbor(s):
+                    self.UpdateState(sn)
+
+    def replan(self):
+        self.ComputeOrImprovePath()
+        while True:
+            if len(self.INCONS) == 0:
+                break
+            self.OPEN.update(self.INCONS)
+            self.INCONS = dict()
+            for s in self.OPEN:
+                self.OPEN[s] = self.Key(s)
+            self.CLOSED = set()
+            self.ComputeOrImprovePath()
+
+    def ComputeOrImprovePath(self):
+        while True:
+            s, v = self.TopKey()
+            if v >= self.Key(self.s_start) and \
+                    self.rhs[self.s_start] == self.g[self.s_start]:
+                break
+
+            self.OPEN.pop(s)
+
+            if self.g[s] > self.rhs[s]:
+                self.g[s] = self.rhs[s]
+                self.CLOSED.add(s)
+                for sn in self.get_neighbor(s):
+                    self.UpdateState(sn)
+            else:
+                self.g[s] = float("inf")
+                for sn in self.get_neighbor(s):
+                    self.UpdateState(sn)
+                self.UpdateState(s)
+
+    def UpdateState(self, s):
+        if s != self.s_goal:
+            self.rhs[s] = float("inf")
+            for x in self.get_neighbor(s):
+                self.rhs[s] = min(self.rhs[s], self.g[x] + self.cost(s, x))
+        if s in self.OPEN:
+            self.OPEN.pop(s)
+
+        if self.g[s] != self.rhs[s]:
+            if s not in self.CLOSED:
+                self.OPEN[s] = self.Key(s)
+            else:
+                self.INCONS[s] = 0
+
+    def Key(self, s):
+        if self.g[s] > self.rhs[s]:
+            return [self.rhs[s] + self.eps * self.h(self.s_start, s), self.rhs[s]]
+        else:
+            return [self.g[s] + self.h(self.s_start, s), self.g[s]]
+
+    def TopKey(self):
+        s = min(self.OPEN, key=self.OPEN.get)
+        return s, self.OPEN[s]
+
+    def h(self, s_start, s_goal):
+        if self.heuristic_type == "manhattan":
+            return abs(s_goal[0] - s_start[0]) + abs(s_goal[1] - s_start[1])
+        else:
+            return math.hypot(s_goal[0] - s_start[0], s_goal[1] - s_start[1])
+
+    def cost(self, s_start, s_goal):
+        if self.is_collision(s_start, s_goal):
+            return float("inf")
+
+        return math.hypot(s_goal[0] - s_start[0], s_goal[1] - s_start[1])
+
+    def is_collision(self, s_start, s_end):
+        if s_start in self.obs or s_end in self.obs:
+            return True
+
+        if s_start[0] != s_end[0] and s_start[1] != s_end[1]:
+            if s_end[0] - s_start[0] == s_start[1] - s_end[1]:
+                s1 = (min(s_start[0], s_end[0]), min(s_start[1], s_end[1]))
+                s2 = (max(s_start[0], s_end[0]), max(s_start[1], s_end[1]))
+            else:
+                s1 = (min(s_start[0], s_end[0]), max(s_start[1], s_end[1]))
+                s2 = (max(s_start[0], s_end[0]), min(s_start[1], s_end[1]))
+
+            if s1 in self.obs or s2 in self.obs:
+                return True
+
+        return False
+
+    def get_neighbor(self, s):
+        nei_list = set()
+        for u in self.u_set:
+            s_next = tuple([s[i] + u[i] for i in range(2)])
+            if 0 <= s_next[0] < self.x and 0 <= s_next[1] < self.y and s_next not in self.obs:
+                nei_list.add(s_next)
+
+        return nei_list
+
+
+def generate_map(size, seed=0, room=20, door=3):
+    """
+    Grid of rooms, roughly like a station floor plan: every wall segment between two rooms has a door,
+    so the map stays connected.
+    """
+    rng = np.random.default_rng(seed)
+    tile_map = np.zeros((size, size), dtype=int)
+    walls = range(room, size - 1, room)
+    for w in walls:
+        tile_map[w, :] = 1
+        tile_map[:, w] = 1
+    bounds = [0] + list(walls) + [size]
+    for w in walls:
+        for lo, hi in zip(bounds, bounds[1:]):
+            if hi - lo - 1 > door:
+                d = int(rng.integers(lo + 1, hi - door))
+                tile_map[w, d:d + door] = 0
+                d = int(rng.integers(lo + 1, hi - door))
+                tile_map[d:d + door, w] = 0
+    return tile_map
+
+
+def random_changes(tile_map, n, seed=0):
+    rng = np.random.default_rng(seed)
+    size = tile_map.shape[0]
+    cells = {(int(x), int(y)) for x, y in rng.integers(1, size - 1, (n, 2))}
+    blocked = [c for c in cells if not tile_map[c]]
+    freed = [c for c in cells if tile_map[c]]
+    return blocked, freed
+
+
+def measure(planner_class, tile_map, changes):
+    size = tile_map.shape[0]
+    start, goal = (0, 0), (size - 1, size - 1)
+
+    t = time.perf_counter()
+    planner = planner_class(tile_map, start, goal, 2.5, "euclidean")
+    planner.run()
+    plan = time.perf_counter() - t
+
+    t = time.perf_counter()
+    planner.update_cells(*changes)
+    planner.replan()
+    repair = time.perf_counter() - t
+
+    cost = planner.g[start] if isinstance(planner, LegacyADStar) else planner.g_of(start)
+    return plan, repair, cost
+
+
+def run(sizes=(100, 500), changes=20):
+    print(f"{'map':>9} {'legacy plan, s':>15} {'Grid plan, s':>13} {'legacy repair, s':>17} "
+          f"{'Grid repair, s':>15} {'speed-up':>9} {'cost diff':>10}")
+    for size in sizes:
+        tile_map = generate_map(size)
+        cells = random_changes(tile_map, changes)
+
+        old_plan, old_repair, old_cost = measure(LegacyADStar, tile_map, cells)
+        new_plan, new_repair, new_cost = measure(GridADStar, tile_map, cells)
+        print(f"{size:>4}x{size:<4} {old_plan:>15.3f} {new_plan:>13.3f} {old_repair:>17.3f} {new_repair:>15.3f} "
+              f"{(old_plan + old_repair) / (new_plan + new_repair):>8.1f}x {new_cost - old_cost:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Anytime D* benchmark')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[100, 500], help='Map sizes')
+    parser.add_argument('-c', '--changes', type=int, default=20, help='Cells toggled before the repair')
+    args = parser.parse_args()
+    run(args.sizes, args.changes)
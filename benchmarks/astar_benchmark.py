@@ -0,0 +1,99 @@
+"""
+A* microbenchmark: the indexed-open-set engine against the original implementation
+on the bundled Projects/*/Models maps.
+
+    python -m benchmarks.astar_benchmark [-n PAIRS]
+"""
+import argparse
+import heapq
+import time
+
+import numpy as np
+
+from simulation import astar, heuristic
+from benchmarks.common import bundled_models, random_free_cells, path_cost, full_path
+
+
+def legacy_astar(array, start, goal):
+    """
+    simulation.astar as it was before the rewrite, kept for comparison.
+    """
+    if tuple(start) == tuple(goal):
+        return [start]
+    neighbors = np.array(((0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)))
+    close_set = set()
+
+    start = tuple(start)
+    goal = tuple(goal)
+
+    came_from = {}
+    gscore = {start: 0}
+
+    fscore = {start: heuristic(start, goal)}
+
+    oheap = []
+    heapq.heappush(oheap, (fscore[start], start))
+
+    while oheap:
+        current = heapq.heappop(oheap)[1]
+        if current == goal:
+            data = []
+            while current in came_from:
+                data.append(current)
+                current = came_from[current]
+            return data
+        close_set.add(current)
+
+        for i, j in neighbors:
+            neighbor = current[0] + i, current[1] + j
+            tentative_g_score = gscore[current] + heuristic(current, neighbor)
+            if not (0 <= neighbor[0] < array.shape[0] and 0 <= neighbor[1] < array.shape[1]):
+                continue
+            if array[neighbor[0]][neighbor[1]] == 1:
+                continue
+
+            if neighbor in close_set and tentative_g_score >= gscore.get(neighbor, 0):
+                continue
+
+            if tentative_g_score < gscore.get(neighbor, 0) or neighbor not in [i[1] for i in oheap]:
+                came_from[neighbor] = current
+                gscore[neighbor] = tentative_g_score
+                fscore[neighbor] = tentative_g_score + heuristic(neighbor, goal)
+                heapq.heappush(oheap, (fscore[neighbor], neighbor))
+
+    return [start]
+
+
+def run(pairs=10):
+    print(f"{'model':<40} {'legacy, ms':>11} {'astar, ms':>10} {'first step, ms':>15} {'speed-up':>9} {'cost diff':>10}")
+    for project_name, model_filename, tile_map in bundled_models():
+        starts = random_free_cells(tile_map, pairs, seed=1)
+        goals = random_free_cells(tile_map, pairs, seed=2)
+
+        timings = {'legacy': 0.0, 'astar': 0.0, 'first_step': 0.0}
+        cost_diff = 0.0
+        for start, goal in zip(starts, goals):
+            t = time.perf_counter()
+            old = legacy_astar(tile_map, start, goal)
+            timings['legacy'] += time.perf_counter() - t
+
+            t = time.perf_counter()
+            new = astar(tile_map, start, goal)
+            timings['astar'] += time.perf_counter() - t
+
+            t = time.perf_counter()
+            astar(tile_map, start, goal, first_step=True)
+            timings['first_step'] += time.perf_counter() - t
+
+            cost_diff += path_cost(full_path(new, start)) - path_cost(full_path(old, start))
+
+        legacy, new, first = (timings[k] * 1000 / pairs for k in ('legacy', 'astar', 'first_step'))
+        print(f"{project_name + '/' + model_filename:<40} {legacy:>11.2f} {new:>10.2f} {first:>15.2f} "
+              f"{legacy / max(new, 1e-9):>8.1f}x {cost_diff / pairs:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='A* microbenchmark')
+    parser.add_argument('-n', '--pairs', type=int, default=10, help='Start/goal pairs per model')
+    args = parser.parse_args()
+    run(args.pairs)
@@ -0,0 +1,63 @@
+import glob
+import os
+import random
+
+import numpy as np
+
+from os_activities import load_simulation_meta
+from utilities import load_model
+
+
+DEFAULT_META = {
+    "GRID_SIZE": (50, 50),
+    "GRID_CELL_SIZE": 10,
+    "SVG_SCALE": 1,
+    "SVG_DELTA": (0, 0),
+}
+
+
+def model_meta(project_name, model_filename):
+    """
+    Discretization parameters of the first bundled simulation that uses the model.
+    """
+    for path in sorted(glob.glob(f'Projects/{project_name}/Simulations/*')):
+        try:
+            meta = load_simulation_meta(path)
+        except (ValueError, KeyError):
+            continue
+        if meta.get('MODEL_FILENAME') == model_filename:
+            return meta
+    return DEFAULT_META
+
+
+def load_tile_map(project_name, model_filename, meta=None):
+    meta = meta or model_meta(project_name, model_filename)
+    return load_model(project_name, model_filename, meta['GRID_SIZE'], meta['GRID_CELL_SIZE'],
+                      svg_scale=meta['SVG_SCALE'], svg_delta=meta['SVG_DELTA'])[2]
+
+
+def bundled_models():
+    """
+    Yields (project name, model filename, tile map) for every model under Projects/.
+    """
+    for path in sorted(glob.glob('Projects/*/Models/*')):
+        project_name = path.split(os.sep)[-3]
+        model_filename = os.path.basename(path)
+        yield project_name, model_filename, load_tile_map(project_name, model_filename)
+
+
+def random_free_cells(tile_map, n, seed=0):
+    free = np.argwhere(np.asarray(tile_map) == 0)
+    rng = random.Random(seed)
+    return [tuple(int(k) for k in free[rng.randrange(len(free))]) for _ in range(n)]
+
+
+def path_cost(path):
+    return sum(np.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(path, path[1:]))
+
+
+def full_path(result, start):
+    """
+    Whole path of an astar-style result, which runs from the goal back to the first step, from start on.
+    """
+    return [tuple(start)] + [tuple(int(k) for k in p) for p in result[::-1]]
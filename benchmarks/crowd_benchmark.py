@@ -0,0 +1,41 @@
+"""
+Social-force crowd engine: milliseconds per tick as the number of agents grows.
+
+    python -m benchmarks.crowd_benchmark [-a AGENTS ...] [-s SIZE] [-t TICKS]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from crowd import SocialForceCrowd, direction_field
+from simulation import distance_field
+from benchmarks.adstar_benchmark import generate_map
+
+
+def run(agents=(1000, 10000), size=300, ticks=20):
+    tile_map = generate_map(size)
+    goal = (size // 2, size // 2)
+    directions = {0: direction_field(distance_field(tile_map, goal))}
+    free = np.argwhere(tile_map == 0)
+    rng = np.random.default_rng(0)
+
+    print(f"{'agents':>7} {'ms / tick':>10} {'agents / s':>12}")
+    for n in agents:
+        crowd = SocialForceCrowd(tile_map, directions)
+        crowd.add(free[rng.choice(len(free), size=n, replace=False)])
+        crowd.step()
+        t = time.perf_counter()
+        for _ in range(ticks):
+            crowd.step()
+        elapsed = (time.perf_counter() - t) / ticks
+        print(f"{n:>7} {elapsed * 1000:>10.1f} {n / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Social-force crowd benchmark')
+    parser.add_argument('-a', '--agents', type=int, nargs='+', default=[1000, 10000], help='Agent counts')
+    parser.add_argument('-s', '--size', type=int, default=300, help='Map side in cells')
+    parser.add_argument('-t', '--ticks', type=int, default=20, help='Timed ticks')
+    args = parser.parse_args()
+    run(args.agents, args.size, args.ticks)
@@ -0,0 +1,55 @@
+"""
+HPA* against the flat A* on large room-grid maps: abstraction build time, cached load time,
+query time and how much longer the hierarchical paths are.
+
+    python -m benchmarks.hpa_benchmark [-s SIZE ...] [-c CLUSTER] [-n PAIRS]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from simulation import astar
+from planning.HPAStar import load_hpa
+from benchmarks.adstar_benchmark import generate_map
+from benchmarks.common import random_free_cells, path_cost, full_path
+
+
+def run(sizes=(100, 300), cluster_size=10, pairs=20):
+    print(f"{'map':>9} {'build, s':>9} {'load, s':>8} {'astar, ms':>10} {'hpa, ms':>8} {'speed-up':>9} "
+          f"{'cost ratio':>11}")
+    for size in sizes:
+        tile_map = generate_map(size)
+        cache_file = os.path.join(tempfile.mkdtemp(), 'map.hpa.npz')
+
+        t = time.perf_counter()
+        load_hpa(tile_map, cluster_size, cache_file)
+        build = time.perf_counter() - t
+        t = time.perf_counter()
+        hpa = load_hpa(tile_map, cluster_size, cache_file)
+        load = time.perf_counter() - t
+
+        flat, hierarchical, ratio = 0.0, 0.0, 0.0
+        for start, goal in zip(random_free_cells(tile_map, pairs, seed=1), random_free_cells(tile_map, pairs, seed=2)):
+            t = time.perf_counter()
+            expected = astar(tile_map, start, goal)
+            flat += time.perf_counter() - t
+
+            t = time.perf_counter()
+            found = hpa.find_path(start, goal)
+            hierarchical += time.perf_counter() - t
+
+            ratio += path_cost(full_path(found, start)) / max(path_cost(full_path(expected, start)), 1e-9)
+
+        flat, hierarchical = flat * 1000 / pairs, hierarchical * 1000 / pairs
+        print(f"{f'{size}x{size}':>9} {build:>9.3f} {load:>8.3f} {flat:>10.2f} {hierarchical:>8.2f} "
+              f"{flat / max(hierarchical, 1e-9):>8.1f}x {ratio / pairs:>11.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='HPA* benchmark')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[100, 300], help='Map sides in cells')
+    parser.add_argument('-c', '--cluster', type=int, default=10, help='Cluster side in cells')
+    parser.add_argument('-n', '--pairs', type=int, default=20, help='Start/goal pairs per map')
+    args = parser.parse_args()
+    run(args.sizes, args.cluster, args.pairs)
@@ -0,0 +1,40 @@
+"""
+Jump Point Search against A* on the bundled Projects/*/Models maps:
+query time, expanded nodes and path cost parity.
+
+    python -m benchmarks.jps_benchmark [-n PAIRS]
+"""
+import argparse
+import time
+
+from simulation import astar, jps
+from benchmarks.common import bundled_models, random_free_cells, path_cost, full_path
+
+
+def run(pairs=10):
+    print(f"{'model':<40} {'astar, ms':>10} {'jps, ms':>8} {'speed-up':>9} {'astar nodes':>12} {'jps nodes':>10} "
+          f"{'cost diff':>10}")
+    for project_name, model_filename, tile_map in bundled_models():
+        timings = {'astar': 0.0, 'jps': 0.0}
+        stats = {'astar': {}, 'jps': {}}
+        cost_diff = 0.0
+        for start, goal in zip(random_free_cells(tile_map, pairs, seed=1), random_free_cells(tile_map, pairs, seed=2)):
+            paths = {}
+            for name, search in (('astar', astar), ('jps', jps)):
+                t = time.perf_counter()
+                paths[name] = search(tile_map, start, goal, stats=stats[name])
+                timings[name] += time.perf_counter() - t
+            cost_diff = max(cost_diff, abs(path_cost(full_path(paths['jps'], start)) -
+                                           path_cost(full_path(paths['astar'], start))))
+
+        a, j = (timings[k] * 1000 / pairs for k in ('astar', 'jps'))
+        a_nodes, j_nodes = (stats[k].get('expanded', 0) / pairs for k in ('astar', 'jps'))
+        print(f"{project_name + '/' + model_filename:<40} {a:>10.2f} {j:>8.2f} {a / max(j, 1e-9):>8.1f}x "
+              f"{a_nodes:>12.0f} {j_nodes:>10.0f} {cost_diff:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Jump Point Search benchmark')
+    parser.add_argument('-n', '--pairs', type=int, default=10, help='Start/goal pairs per model')
+    args = parser.parse_args()
+    run(args.pairs)
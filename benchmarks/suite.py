@@ -0,0 +1,254 @@
+"""
+Benchmark suite over the bundled Projects/*/Models layouts: headless, with a fixed seed,
+at several grid sizes and agent counts. Results are written as JSON and compared against a stored baseline;
+the exit code is 1 if any case got slower than the threshold allows.
+
+    python -m benchmarks.suite [-o results.json] [-b benchmarks/baseline.json] [--save-baseline]
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from analysis import bake_heatmaps
+from agents import AgentStore
+from os_activities import open_trajectory, open_trajectory_writer
+from planning.HPAStar import HPAPlanner, load_hpa
+from planning.Star import ADStarPlanner, GridADStar
+from simulation import GoalCache, adstar_planner, astar, distance_field, jps, step_agents
+from utilities import discrete_png, generate_tile_map, get_rects
+from benchmarks.common import model_meta, random_free_cells
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+SEED = 0
+# Grid sizes as multiples of the grid of the bundled simulations
+GRID_SCALES = (1, 2, 4)
+ADSTAR_SCALES = (1, 2)
+AGENT_COUNTS = (20, 100)
+PLANNERS = ('astar', 'jps', 'flow', 'adstar', 'hpa')
+# Ticks of step_agents per timed run, from the same start every time
+TICKS = 5
+TRAJECTORY_AGENTS = (100, 1000)
+TRAJECTORY_FRAMES = 200
+# Differences below this are timer noise, never regressions
+MIN_SECONDS = 1e-3
+
+
+def timed(fn, repeats):
+    """
+    :return: median wall time of fn over repeats calls, seconds
+    """
+    runs = []
+    for _ in range(repeats):
+        t = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t)
+    return float(np.median(runs))
+
+
+def bundled_layouts():
+    """
+    Yields (project name, model filename, model path, meta of the bundled simulations that use it).
+    """
+    for path in sorted(glob.glob('Projects/*/Models/*')):
+        project_name = path.split(os.sep)[-3]
+        model_filename = os.path.basename(path)
+        yield project_name, model_filename, path, model_meta(project_name, model_filename)
+
+
+def discretizer(path, meta, scale):
+    """
+    :return: grid size and a function building the tile map of the model at scale times the bundled grid
+    """
+    grid_size = tuple(int(k) * scale for k in meta['GRID_SIZE'])
+    if path.endswith('.svg'):
+        # The drawing is scaled with the grid, cells keep their size in pixels
+        rects = get_rects(path, svg_delta=[k * scale for k in meta['SVG_DELTA']], svg_scale=meta['SVG_SCALE'] * scale)
+        return grid_size, lambda: generate_tile_map(rects, grid_size, meta['GRID_CELL_SIZE'])
+    return grid_size, lambda: discrete_png(path, grid_size, image_delta=meta['SVG_DELTA'],
+                                           image_scale=meta['SVG_SCALE'])
+
+
+def random_walk(tile_map, agents, frames, rng):
+    """
+    Synthetic trajectory: agents start on free cells and step to a random free neighbour or stay.
+    """
+    free = np.argwhere(tile_map == 0)
+    positions = free[rng.integers(len(free), size=agents)]
+    w, h = tile_map.shape
+    paths = []
+    for _ in range(frames):
+        moved = np.clip(positions + rng.integers(-1, 2, size=positions.shape), 0, (w - 1, h - 1))
+        ok = tile_map[moved[:, 0], moved[:, 1]] == 0
+        positions = np.where(ok[:, None], moved, positions)
+        paths.append(positions.tolist())
+    return paths
+
+
+def tick_loop(tile_map, positions, goals, goal_ids, planner, ticks=TICKS):
+    """
+    :return: function running ticks of the grid engine from the same agents: AD* planners updated to the store,
+    then step_agents. Fields, HPA* abstraction and converged planners are built once, outside of the timing
+    """
+    fields = planners = adstar = None
+    if planner == 'flow':
+        fields = GoalCache(goals, lambda g: distance_field(tile_map, g)).precompute()
+    elif planner == 'hpa':
+        hpa = load_hpa(tile_map)
+        planners = GoalCache(goals, lambda g: HPAPlanner(hpa, g)).precompute()
+    elif planner == 'adstar':
+        store = AgentStore(tile_map, capacity=len(positions))
+        store.add(positions, goal_ids)
+        adstar = GoalCache(goals, lambda g: adstar_planner(store, g)).precompute().state(lambda p: p.state())
+    search = jps if planner == 'jps' else astar
+
+    def run():
+        store = AgentStore(tile_map, capacity=len(positions))
+        store.add(positions, goal_ids)
+        caches = planners
+        if adstar is not None:
+            caches = GoalCache(goals, None).restore(adstar, lambda g, arrays: ADStarPlanner(tile_map, g, state=arrays))
+        for _ in range(ticks):
+            if adstar is not None:
+                for p in caches.values():
+                    p.update(store.blocked)
+            step_agents(store, goals, fields=fields, planners=caches, search=search)
+
+    return run
+
+
+def save_trajectory(paths_file, paths, meta):
+    with open_trajectory_writer(paths_file, meta) as writer:
+        for points in paths:
+            writer.write(points)
+
+
+def load_trajectory(paths_file):
+    _, paths = open_trajectory(paths_file)
+    for k in range(len(paths)):
+        paths[k]
+    return paths
+
+
+def cases(directory):
+    """
+    Yields (case name, function to time) for every bundled layout.
+    """
+    for project_name, model_filename, path, meta in bundled_layouts():
+        layout = f'{project_name}/{model_filename}'
+        kind = 'generate_tile_map' if path.endswith('.svg') else 'discrete_png'
+        tile_maps = {}
+        for scale in GRID_SCALES:
+            grid_size, build = discretizer(path, meta, scale)
+            tile_maps[scale] = np.asarray(build(), dtype=int)
+            yield f'{kind}/{layout}/{grid_size[0]}x{grid_size[1]}', build
+
+        for scale in GRID_SCALES:
+            tile_map = tile_maps[scale]
+            pairs = list(zip(random_free_cells(tile_map, 10, seed=SEED),
+                             random_free_cells(tile_map, 10, seed=SEED + 1)))
+            yield (f'astar/{layout}/{tile_map.shape[0]}x{tile_map.shape[1]}',
+                   lambda tile_map=tile_map, pairs=pairs: [astar(tile_map, s, g) for s, g in pairs])
+
+        for scale in ADSTAR_SCALES:
+            tile_map = tile_maps[scale]
+            start, goal = random_free_cells(tile_map, 2, seed=SEED)
+            yield (f'adstar/{layout}/{tile_map.shape[0]}x{tile_map.shape[1]}',
+                   lambda tile_map=tile_map, start=start, goal=goal:
+                   GridADStar(tile_map, start, goal, 2.5, 'euclidean').run())
+
+        tile_map = tile_maps[1]
+        goals = np.array(random_free_cells(tile_map, 2, seed=SEED), dtype=np.int64)
+        for n in AGENT_COUNTS:
+            positions = random_free_cells(tile_map, n, seed=SEED + 1)
+            goal_ids = np.arange(n) % len(goals)
+            for planner in PLANNERS:
+                yield (f'step_agents/{planner}/{layout}/{n}',
+                       tick_loop(tile_map, positions, goals, goal_ids, planner))
+
+        rng = np.random.default_rng(SEED)
+        grid_size = tile_map.shape
+        for n in TRAJECTORY_AGENTS:
+            paths = random_walk(tile_map, n, TRAJECTORY_FRAMES, rng)
+            for extension in ('json', 'traj'):
+                paths_file = os.path.join(directory, f'{project_name}.{model_filename}.{n}.{extension}')
+                save_trajectory(paths_file, paths, meta)
+                yield (f'trajectory_save/{extension}/{layout}/{n}',
+                       lambda paths_file=paths_file, paths=paths: save_trajectory(paths_file, paths, meta))
+                yield (f'trajectory_load/{extension}/{layout}/{n}',
+                       lambda paths_file=paths_file: load_trajectory(paths_file))
+                loaded = load_trajectory(paths_file)
+                yield (f'heatmaps/{extension}/{layout}/{n}',
+                       lambda loaded=loaded: bake_heatmaps(loaded, grid_size))
+
+
+def run(repeats=3, only=None):
+    """
+    :param only: run only the cases whose name contains this string
+    :return: results dict, case name -> median seconds
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, fn in cases(directory):
+            if only and only not in name:
+                continue
+            random.seed(SEED)
+            np.random.seed(SEED)
+            results[name] = timed(fn, repeats)
+            print(f'{name:<70} {results[name] * 1000:>10.2f} ms', file=sys.stderr)
+    return {
+        'meta': {'seed': SEED, 'repeats': repeats, 'python': platform.python_version(), 'numpy': np.__version__,
+                 'machine': platform.machine(), 'processor': platform.processor()},
+        'results': results
+    }
+
+
+def compare(results, baseline, threshold=1.25):
+    """
+    :return: names of the cases that got more than threshold times slower than the baseline
+    """
+    regressions = []
+    print(f"{'case':<70} {'baseline, ms':>13} {'now, ms':>10} {'ratio':>7}")
+    for name, seconds in results['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f'{name:<70} {"-":>13} {seconds * 1000:>10.2f} {"new":>7}')
+            continue
+        ratio = seconds / max(before, 1e-9)
+        slower = ratio > threshold and seconds - before > MIN_SECONDS
+        if slower:
+            regressions.append(name)
+        print(f'{name:<70} {before * 1000:>13.2f} {seconds * 1000:>10.2f} {ratio:>6.2f}x{" !" if slower else ""}')
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark suite over the bundled projects')
+    parser.add_argument('-r', '--repeats', type=int, default=3, help='Runs per case, the median is kept')
+    parser.add_argument('-k', '--only', default=None, help='Run only the cases whose name contains this')
+    parser.add_argument('-o', '--output', default=None, help='JSON file for the results')
+    parser.add_argument('-b', '--baseline', default=BASELINE_FILE, help='Baseline results to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=1.25, help='Slowdown ratio counted as regression')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline')
+    args = parser.parse_args()
+
+    results = run(args.repeats, args.only)
+    if args.output:
+        with open(args.output, mode='w') as f:
+            json.dump(results, f, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, mode='w') as f:
+            json.dump(results, f, indent=1)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, mode='r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions: {", ".join(regressions)}')
+            sys.exit(1)
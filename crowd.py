@@ -0,0 +1,219 @@
+import numpy as np
+
+MOTIONS = ((0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1))
+# Hash buckets around an agent's own one
+_BLOCK = tuple((i, j) for i in (-1, 0, 1) for j in (-1, 0, 1))
+
+
+def direction_field(field) -> np.ndarray:
+    """
+    Unit vectors from every cell towards its lowest-cost neighbour in a distance field, zero where there is none.
+    A body cannot squeeze diagonally between two walls, so from reachable cells such moves are left out.
+    :return: (W, H, 2) float array
+    """
+    w, h = field.shape
+    padded = np.pad(field, 1, constant_values=np.inf)
+    reachable = np.isfinite(padded)
+    best = np.asarray(field, dtype=np.float64).copy()
+    direction = np.zeros((w, h, 2))
+    for i, j in MOTIONS:
+        shifted = padded[1 + i:1 + i + w, 1 + j:1 + j + h]
+        better = shifted < best
+        if i and j:
+            better &= ~np.isfinite(field) | (reachable[1 + i:1 + i + w, 1:1 + h] & reachable[1:1 + w, 1 + j:1 + j + h])
+        best[better] = shifted[better]
+        direction[better] = (i, j)
+    norm = np.hypot(direction[..., 0], direction[..., 1])
+    direction[norm > 0] /= norm[norm > 0, None]
+    return direction
+
+
+def neighbor_pairs(points, cutoff):
+    """
+    Every ordered pair (i, j), i != j, of points closer than cutoff.
+    Points are bucketed in a uniform grid of cutoff-sized cells, so only the 3x3 buckets around each point are checked.
+    :return: i, j index arrays, (K, 2) offsets points[i] - points[j] and (K,) distances
+    """
+    n = len(points)
+    cells = np.floor(points / cutoff).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    height = cells[:, 1].max() + 2
+    keys = cells[:, 0] * height + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    first, second = [], []
+    for i, j in _BLOCK:
+        target = keys + i * height + j
+        lo = np.searchsorted(sorted_keys, target, side='left')
+        counts = np.searchsorted(sorted_keys, target, side='right') - lo
+        total = counts.sum()
+        if total == 0:
+            continue
+        starts = np.cumsum(counts) - counts
+        first.append(np.repeat(np.arange(n), counts))
+        second.append(order[np.repeat(lo - starts, counts) + np.arange(total)])
+    if not first:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros((0, 2)), np.zeros(0)
+
+    first, second = np.concatenate(first), np.concatenate(second)
+    offsets = points[first] - points[second]
+    distances = np.hypot(offsets[:, 0], offsets[:, 1])
+    close = (first != second) & (distances < cutoff)
+    return first[close], second[close], offsets[close], distances[close]
+
+
+class SocialForceCrowd:
+    """
+    Continuous-space crowd moved by a social-force model, all agents at once.
+    Positions and velocities are in cells and cells per tick; the goal direction comes from a
+    per-goal direction field over TILE_MAP, agents push each other away and are pushed off walls.
+    Has the parts of the AgentStore interface the simulation loop uses; slots are always 0..N-1.
+    """
+
+    def __init__(self, tile_map, directions, speed=1.0, radius=0.3, tau=0.5, strength=2.0, range_=0.3,
+                 wall_strength=5.0, wall_range=0.15, substeps=4):
+        """
+        :param directions: goal id -> (W, H, 2) direction field, e.g. a GoalCache of direction_field
+        :param speed: preferred speed, cells per tick
+        :param radius: agent body radius, cells
+        :param tau: relaxation time towards the preferred velocity, ticks
+        :param strength: agent repulsion strength, range_ - its decay length
+        :param wall_strength: wall repulsion strength, wall_range - its decay length
+        :param substeps: integration steps per tick
+        """
+        self.static = np.asarray(tile_map, dtype=bool)
+        # Blocked border, so agents never leave the map
+        self.walls = np.pad(self.static, 1, constant_values=True)
+        self.directions = directions
+        self.speed, self.radius, self.tau = speed, radius, tau
+        self.strength, self.range = strength, range_
+        self.wall_strength, self.wall_range = wall_strength, wall_range
+        self.substeps = int(substeps)
+        self.cutoff = 2 * radius + 4 * range_
+
+        self.positions = np.zeros((0, 2))
+        self.velocities = np.zeros((0, 2))
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.goals = np.zeros(0, dtype=np.int64)
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, positions, goals=0) -> np.ndarray:
+        """
+        :param positions: cells, agents start at their centres
+        :return: slots of the new agents
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2) + 0.5
+        n = len(positions)
+        slots = np.arange(len(self), len(self) + n)
+        self.positions = np.concatenate((self.positions, positions))
+        self.velocities = np.concatenate((self.velocities, np.zeros((n, 2))))
+        self.ids = np.concatenate((self.ids, np.arange(self.next_id, self.next_id + n)))
+        self.goals = np.concatenate((self.goals, np.broadcast_to(np.asarray(goals, dtype=np.int64), (n,))))
+        self.next_id += n
+        return slots
+
+    def remove(self, slots):
+        keep = np.ones(len(self), dtype=bool)
+        keep[slots] = False
+        self.positions = self.positions[keep]
+        self.velocities = self.velocities[keep]
+        self.ids = self.ids[keep]
+        self.goals = self.goals[keep]
+
+    def state(self) -> dict:
+        return {'positions': self.positions, 'velocities': self.velocities, 'ids': self.ids, 'goals': self.goals,
+                'next_id': np.array(self.next_id)}
+
+    def restore(self, state):
+        self.positions = np.array(state['positions'], dtype=np.float64).reshape(-1, 2)
+        self.velocities = np.array(state['velocities'], dtype=np.float64).reshape(-1, 2)
+        self.ids = np.array(state['ids'], dtype=np.int64)
+        self.goals = np.array(state['goals'], dtype=np.int64)
+        self.next_id = int(state['next_id'])
+
+    def set_static(self, tile_map):
+        self.static = np.asarray(tile_map, dtype=bool).copy()
+        self.walls = np.pad(self.static, 1, constant_values=True)
+
+    def active_slots(self) -> np.ndarray:
+        return np.arange(len(self))
+
+    def active_positions(self) -> np.ndarray:
+        return np.floor(self.positions).astype(np.int64)
+
+    def active_ids(self) -> np.ndarray:
+        return self.ids
+
+    def blocked(self, points) -> np.ndarray:
+        cells = np.floor(points).astype(np.int64) + 1
+        cells[:, 0] = np.clip(cells[:, 0], 0, self.walls.shape[0] - 1)
+        cells[:, 1] = np.clip(cells[:, 1], 0, self.walls.shape[1] - 1)
+        return self.walls[cells[:, 0], cells[:, 1]]
+
+    def desired_directions(self) -> np.ndarray:
+        cells = self.active_positions()
+        result = np.zeros((len(self), 2))
+        for goal_id in np.unique(self.goals):
+            mine = self.goals == goal_id
+            result[mine] = self.directions[goal_id][cells[mine, 0], cells[mine, 1]]
+        return result
+
+    def agent_forces(self) -> np.ndarray:
+        i, _, offsets, distances = neighbor_pairs(self.positions, self.cutoff)
+        magnitude = self.strength * np.exp((2 * self.radius - distances) / self.range) / np.maximum(distances, 1e-6)
+        forces = np.zeros((len(self), 2))
+        forces[:, 0] = np.bincount(i, magnitude * offsets[:, 0], minlength=len(self))
+        forces[:, 1] = np.bincount(i, magnitude * offsets[:, 1], minlength=len(self))
+        return forces
+
+    def wall_forces(self) -> np.ndarray:
+        """
+        Push away from the nearest point of every blocked cell in the 3x3 block around each agent.
+        """
+        forces = np.zeros((len(self), 2))
+        cells = np.floor(self.positions).astype(np.int64)
+        for i, j in MOTIONS:
+            corner = cells + (i, j)
+            wall = self.blocked(corner + 0.5)
+            if not wall.any():
+                continue
+            nearest = np.clip(self.positions[wall], corner[wall], corner[wall] + 1)
+            away = self.positions[wall] - nearest
+            distance = np.hypot(away[:, 0], away[:, 1])
+            magnitude = np.where(distance > 0, self.wall_strength * np.exp((self.radius - distance) / self.wall_range)
+                                 / np.maximum(distance, 1e-6), 0.0)
+            forces[wall] += magnitude[:, None] * away
+        return forces
+
+    def step(self) -> int:
+        """
+        Advances every agent by one tick.
+        :return: number of agents that stayed in their cell
+        """
+        if len(self) == 0:
+            return 0
+        before = self.active_positions()
+        dt = 1.0 / self.substeps
+        max_speed = 1.3 * self.speed
+        for _ in range(self.substeps):
+            desired = self.speed * self.desired_directions()
+            acceleration = (desired - self.velocities) / self.tau + self.agent_forces() + self.wall_forces()
+            self.velocities += acceleration * dt
+            speed = np.hypot(self.velocities[:, 0], self.velocities[:, 1])
+            too_fast = speed > max_speed
+            self.velocities[too_fast] *= (max_speed / speed[too_fast])[:, None]
+
+            # Axis by axis, so an agent slides along a wall instead of entering it
+            for axis in (0, 1):
+                moved = self.positions.copy()
+                moved[:, axis] += self.velocities[:, axis] * dt
+                # Agents spawned inside a wall may still walk out of it
+                hit = self.blocked(moved) & ~self.blocked(self.positions)
+                self.positions[~hit] = moved[~hit]
+                self.velocities[hit, axis] = 0.0
+        return int(np.count_nonzero(np.all(self.active_positions() == before, axis=1)))
@@ -7,7 +7,7 @@ from tkinter import simpledialog
 from tkinter.filedialog import askopenfilename
 from subprocess import Popen
 
-from os_activities import create_new_project
+from os_activities import create_new_project, load_simulation_meta
 import glob
 
 from simulation import run_simulation
@@ -43,8 +43,7 @@ class Project:
 
     def get_sim_meta(self, sim_name):
         path = f'Projects/{self.name}/Simulations/{sim_name}'
-        meta = json.load(open(path, mode='r'))['meta']
-        return meta
+        return load_simulation_meta(path)
 
     def run_simulation(self, simulation_name):
         run_simulation(self.name, simulation_name)
@@ -1,5 +1,8 @@
 import json
 import os
+import struct
+
+import numpy as np
 
 
 def create_new_project(project_name):
@@ -19,17 +22,299 @@ def create_new_project(project_name):
         }, f)"""
 
 
-def save_points(points, meta, paths_file):
-    open(paths_file, mode='a').close()
-    d = open(paths_file, mode='r+')
+class TrajectoryWriter:
+    """
+    Append-only frame log: a {"meta": ...} header line followed by one JSON line per frame.
+    Frames are buffered and flushed in batches, so every frame costs the same to record.
+    """
+
+    def __init__(self, paths_file, meta, flush_every=256, resume=None):
+        """
+        :param resume: state() taken at a checkpoint; the log is cut back to it and continued
+        """
+        self.paths_file = paths_file
+        self.flush_every = flush_every
+        self.buffer = []
+        self.frames = 0
+        if resume is None:
+            self.file = open(paths_file, mode='w')
+            self.file.write(json.dumps({"meta": meta}) + '\n')
+        else:
+            self.file = open(paths_file, mode='r+')
+            self.file.truncate(int(resume['position']))
+            self.file.seek(0, os.SEEK_END)
+            self.frames = int(resume['frames'])
+
+    def write(self, points, ids=None):
+        """
+        Empty frames are kept, so the gaps between scheduled waves replay in real time.
+        :param ids: accepted for BinaryTrajectoryWriter compatibility, the JSON log keeps agents by index
+        """
+        self.buffer.append(json.dumps(points))
+        self.frames += 1
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write('\n'.join(self.buffer) + '\n')
+            self.buffer = []
+        self.file.flush()
+
+    def state(self) -> dict:
+        """
+        Writes everything recorded so far to disk.
+        :return: where to resume the log from
+        """
+        self.flush()
+        os.fsync(self.file.fileno())
+        return {'position': np.array(self.file.tell()), 'frames': np.array(self.frames)}
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _read_header(f):
+    """
+    :return: header of a frame log, None for a legacy {"meta", "paths"} file
+    """
     try:
-        paths = json.load(d)['paths']
-    except:
-        paths = []
-    paths += [points] if points != [] else []
+        header = json.loads(f.readline())
+    except ValueError:
+        return None
+    if not isinstance(header, dict) or 'paths' in header:
+        return None
+    return header
+
+
+def load_points(paths_file):
+    """
+    Reads both the frame log written by TrajectoryWriter and the legacy {"meta", "paths"} JSON.
+    :return: meta, paths
+    """
+    with open(paths_file, mode='r') as f:
+        header = _read_header(f)
+        if header is not None:
+            return header['meta'], [json.loads(line) for line in f if line.strip()]
+        f.seek(0)
+        data = json.load(f)
+    return data['meta'], data['paths']
+
+
+def load_simulation_meta(paths_file):
+    if is_binary_trajectory(paths_file):
+        return TrajectoryReader(paths_file).meta
+    with open(paths_file, mode='r') as f:
+        header = _read_header(f)
+        if header is not None:
+            return header['meta']
+        f.seek(0)
+        return json.load(f)['meta']
+
+
+def export_json(paths_file, json_file):
+    """
+    Exports a simulation as a single {"meta", "paths"} JSON document.
+    """
+    meta, paths = open_trajectory(paths_file)
+    paths = [paths[k] for k in range(len(paths))]
+    with open(json_file, mode='w') as f:
+        json.dump({"meta": meta, "paths": paths}, f)
+
+
+# Binary trajectory (*.traj):
+#   magic | uint32 meta length | meta JSON | padding to 8 bytes
+#   frame rows: int32 agent id, int16 x, int16 y
+#   int64 row offsets of every frame (n_frames + 1) | uint64 n_frames | index magic
+TRAJECTORY_MAGIC = b'SKTRAJ01'
+TRAJECTORY_INDEX_MAGIC = b'SKINDX01'
+TRAJECTORY_ROW = np.dtype([('id', '<i4'), ('pos', '<i2', (2,))])
+
+
+class BinaryTrajectoryWriter:
+    """
+    Same interface as TrajectoryWriter; writes the compact binary format.
+    The frame index is appended on close().
+    """
+
+    def __init__(self, paths_file, meta, flush_every=256, resume=None):
+        """
+        :param resume: state() taken at a checkpoint; frames written after it and the index are cut off
+        """
+        self.paths_file = paths_file
+        self.flush_every = flush_every
+        self.buffer = []
+        self.offsets = [0]
+        self.frames = 0
+        if resume is not None:
+            self.file = open(paths_file, mode='r+b')
+            self.file.truncate(int(resume['position']))
+            self.file.seek(0, os.SEEK_END)
+            self.offsets = resume['offsets'].tolist()
+            self.frames = int(resume['frames'])
+            return
+        self.file = open(paths_file, mode='wb')
+
+        header = json.dumps(meta).encode()
+        self.file.write(TRAJECTORY_MAGIC + struct.pack('<I', len(header)) + header)
+        self.file.write(b'\0' * (-self.file.tell() % 8))
+
+    def write(self, points, ids=None):
+        rows = np.empty(len(points), dtype=TRAJECTORY_ROW)
+        rows['pos'] = np.asarray(points).reshape(-1, 2)
+        rows['id'] = np.arange(len(points)) if ids is None else ids
+        self.buffer.append(rows)
+        self.offsets.append(self.offsets[-1] + len(rows))
+        self.frames += 1
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(np.concatenate(self.buffer).tobytes())
+            self.buffer = []
+        self.file.flush()
+
+    def state(self) -> dict:
+        self.flush()
+        os.fsync(self.file.fileno())
+        return {'position': np.array(self.file.tell()), 'frames': np.array(self.frames),
+                'offsets': np.array(self.offsets, dtype=np.int64)}
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.write(np.asarray(self.offsets, dtype='<i8').tobytes())
+        self.file.write(struct.pack('<Q', self.frames) + TRAJECTORY_INDEX_MAGIC)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 
-    d.close()
-    json.dump({"meta": meta, "paths": paths}, open(paths_file, mode='w'))
+class TrajectoryReader:
+    """
+    Memory-mapped access to a binary trajectory; frame k is read in O(1) without loading the rest.
+    """
+
+    def __init__(self, paths_file):
+        with open(paths_file, mode='rb') as f:
+            if f.read(8) != TRAJECTORY_MAGIC:
+                raise ValueError(f'{paths_file} is not a binary trajectory')
+            header_length, = struct.unpack('<I', f.read(4))
+            self.meta = json.loads(f.read(header_length))
+            data_offset = 12 + header_length
+            data_offset += -data_offset % 8
+
+            f.seek(-16, os.SEEK_END)
+            frames, = struct.unpack('<Q', f.read(8))
+            if f.read(8) != TRAJECTORY_INDEX_MAGIC:
+                raise ValueError(f'{paths_file} has no frame index, the simulation was not closed')
+            index_offset = f.tell() - 16 - (frames + 1) * 8
+
+        self.index = np.memmap(paths_file, dtype='<i8', mode='r', offset=index_offset, shape=(frames + 1,))
+        rows = int(self.index[-1])
+        self.rows = np.memmap(paths_file, dtype=TRAJECTORY_ROW, mode='r', offset=data_offset, shape=(rows,)) \
+            if rows else np.empty(0, dtype=TRAJECTORY_ROW)
+
+    def __len__(self):
+        return len(self.index) - 1
+
+    def frame(self, k):
+        """
+        :return: (n, 2) int16 view of the agent positions in frame k
+        """
+        return self.rows['pos'][self.index[k]:self.index[k + 1]]
+
+    def ids(self, k):
+        return self.rows['id'][self.index[k]:self.index[k + 1]]
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += len(self)
+        return self.frame(k).tolist()
+
+
+def is_binary_trajectory(paths_file):
+    with open(paths_file, mode='rb') as f:
+        return f.read(8) == TRAJECTORY_MAGIC
+
+
+def open_trajectory(paths_file):
+    """
+    :return: meta and frames; frames[k] is a list of [x, y] for every supported format
+    """
+    if is_binary_trajectory(paths_file):
+        reader = TrajectoryReader(paths_file)
+        return reader.meta, reader
+    return load_points(paths_file)
+
+
+def open_trajectory_writer(paths_file, meta, flush_every=256, resume=None):
+    if paths_file.endswith('.traj'):
+        return BinaryTrajectoryWriter(paths_file, meta, flush_every, resume)
+    return TrajectoryWriter(paths_file, meta, flush_every, resume)
+
+
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_path(paths_file):
+    directory, name = os.path.split(paths_file)
+    return os.path.join(directory, f'.{name}.checkpoint.npz')
+
+
+def save_checkpoint(checkpoint_file, arrays, values):
+    """
+    Replaces the checkpoint atomically, so a crash while writing leaves the previous one intact.
+    :param arrays: name -> numpy array
+    :param values: JSON-serializable state
+    """
+    tmp_file = checkpoint_file + '.tmp.npz'
+    with open(tmp_file, mode='wb') as f:
+        np.savez(f, version=CHECKPOINT_VERSION, values=json.dumps(values), **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, checkpoint_file)
+
+
+def load_checkpoint(checkpoint_file):
+    """
+    :return: arrays and values as given to save_checkpoint
+    """
+    if not os.path.exists(checkpoint_file):
+        raise ValueError(f'Checkpoint {checkpoint_file} does not exist')
+    with np.load(checkpoint_file) as cached:
+        if int(cached['version']) != CHECKPOINT_VERSION:
+            raise ValueError(f'Checkpoint {checkpoint_file} has version {int(cached["version"])}, '
+                             f'expected {CHECKPOINT_VERSION}')
+        values = json.loads(str(cached['values']))
+        arrays = {name: cached[name] for name in cached.files if name not in ('version', 'values')}
+    return arrays, values
+
+
+def convert_to_binary(paths_file, traj_file=None):
+    """
+    Converts a JSON simulation (legacy or frame log) to the binary format.
+    """
+    traj_file = traj_file or os.path.splitext(paths_file)[0] + '.traj'
+    meta, paths = load_points(paths_file)
+    with BinaryTrajectoryWriter(traj_file, meta) as writer:
+        for points in paths:
+            writer.write(points)
+    return traj_file
 
 
 def get_simulations():
@@ -45,3 +330,23 @@ def load_meta(project_name):
     SVG_DELTA = meta['SVG_DELTA']
     FILENAME = meta['FILENAME']
     FONT_NAME = meta['FONT_NAME']
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SkillUp simulation export')
+    parser.add_argument('SIMULATION', nargs='+', help='Path to the simulation file(s)')
+    parser.add_argument('-f', '--FORMAT', choices=('json', 'traj'), default='json',
+                        help='json - {"meta", "paths"} document, traj - binary trajectory')
+    parser.add_argument('-o', '--OUTPUT', help='Output file, only for a single simulation')
+
+    args = vars(parser.parse_args())
+    if args['OUTPUT'] is not None and len(args['SIMULATION']) > 1:
+        parser.error('-o can only be used with a single simulation')
+
+    for simulation in args['SIMULATION']:
+        if args['FORMAT'] == 'traj':
+            print(convert_to_binary(simulation, args['OUTPUT']))
+        else:
+            export_json(simulation, args['OUTPUT'] or os.path.splitext(simulation)[0] + '.export.json')
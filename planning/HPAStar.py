@@ -0,0 +1,324 @@
+"""
+Hierarchical path-finding (HPA*) over the simulation tile map.
+
+The map is cut into square clusters. Free cells facing each other across a cluster border become
+entrance nodes, and the shortest paths between the entrances of one cluster become edges of an abstract graph.
+A query searches the abstract graph first and only then refines the chosen edges on the full grid.
+"""
+
+import hashlib
+import heapq
+import math
+import os
+
+import numpy as np
+
+HPA_VERSION = 1
+
+MOTIONS = ((0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1))
+# Runs of free border cells at least this wide get an entrance at both ends instead of one in the middle
+MAX_ENTRANCE_WIDTH = 6
+
+
+def _count_expanded(stats, expanded):
+    if stats is not None:
+        stats['expanded'] = stats.get('expanded', 0) + expanded
+
+
+def local_search(blocked, source, bounds, target=None, occupied=None, stats=None):
+    """
+    Dijkstra from source over the free cells inside bounds, 8-connected.
+    :param bounds: ((x0, y0), (x1, y1)), upper bounds excluded
+    :param target: stop as soon as this cell is reached; it is entered even if occupied
+    :param occupied: cells taken by agents, treated as obstacles
+    :param stats: dict, 'expanded' is increased by the number of expanded cells
+    :return: dict cell -> cost, dict cell -> parent
+    """
+    (x0, y0), (x1, y1) = bounds
+    dist = {source: 0.0}
+    parent = {}
+    oheap = [(0.0, source)]
+    expanded = 0
+    while oheap:
+        d, current = heapq.heappop(oheap)
+        if d > dist[current]:
+            continue
+        if current == target:
+            break
+        expanded += 1
+        x, y = current
+        for i, j in MOTIONS:
+            nx, ny = x + i, y + j
+            if not (x0 <= nx < x1 and y0 <= ny < y1) or blocked[nx, ny]:
+                continue
+            neighbor = (nx, ny)
+            if occupied is not None and occupied[nx, ny] and neighbor != target:
+                continue
+            nd = d + (math.sqrt(2) if i and j else 1.0)
+            if nd < dist.get(neighbor, math.inf):
+                dist[neighbor] = nd
+                parent[neighbor] = current
+                heapq.heappush(oheap, (nd, neighbor))
+    _count_expanded(stats, expanded)
+    return dist, parent
+
+
+def _trace(parent, source, target):
+    path = []
+    current = target
+    while current != source:
+        path.append(current)
+        current = parent[current]
+    return path[::-1]
+
+
+class HPAStar:
+    def __init__(self, tile_map, cluster_size=10):
+        """
+        :param tile_map: tile map indexed [x][y], 1 - obstacle (simulation TILE_MAP)
+        :param cluster_size: side of a cluster in cells
+        """
+        self.blocked = np.asarray(tile_map, dtype=bool)
+        self.w, self.h = self.blocked.shape
+        self.cluster_size = int(cluster_size)
+        self.nodes = np.zeros((0, 2), dtype=np.int64)
+        self.edges = np.zeros((0, 3))
+
+    def cluster(self, cell):
+        return cell[0] // self.cluster_size, cell[1] // self.cluster_size
+
+    def bounds(self, cluster):
+        cs = self.cluster_size
+        return ((cluster[0] * cs, cluster[1] * cs),
+                (min((cluster[0] + 1) * cs, self.w), min((cluster[1] + 1) * cs, self.h)))
+
+    def _entrances(self):
+        """
+        :return: pairs of cells facing each other across the cluster borders
+        """
+        cs = self.cluster_size
+        pairs = []
+        for vertical in (True, False):
+            border_range = range(cs, self.w if vertical else self.h, cs)
+            length = self.h if vertical else self.w
+            for b in border_range:
+                for start in range(0, length, cs):
+                    run = []
+                    for k in range(start, min(start + cs, length)):
+                        a, c = ((b - 1, k), (b, k)) if vertical else ((k, b - 1), (k, b))
+                        if not self.blocked[a] and not self.blocked[c]:
+                            run.append((a, c))
+                            if k + 1 < min(start + cs, length):
+                                continue
+                        if run:
+                            if len(run) >= MAX_ENTRANCE_WIDTH:
+                                pairs += [run[0], run[-1]]
+                            else:
+                                pairs.append(run[len(run) // 2])
+                            run = []
+        return pairs
+
+    def build(self):
+        """
+        Abstract graph: entrance nodes, one step edges across the borders
+        and shortest path edges between the entrances of every cluster.
+        """
+        node_ids = {}
+
+        def node(cell):
+            if cell not in node_ids:
+                node_ids[cell] = len(node_ids)
+            return node_ids[cell]
+
+        edges = []
+        for a, c in self._entrances():
+            edges += [(node(a), node(c), 1.0), (node(c), node(a), 1.0)]
+
+        cells = list(node_ids)
+        by_cluster = {}
+        for cell in cells:
+            by_cluster.setdefault(self.cluster(cell), []).append(cell)
+        for cluster, members in by_cluster.items():
+            bounds = self.bounds(cluster)
+            for n, cell in enumerate(members):
+                dist, _ = local_search(self.blocked, cell, bounds)
+                for other in members[n + 1:]:
+                    if other in dist:
+                        edges += [(node_ids[cell], node_ids[other], dist[other]),
+                                  (node_ids[other], node_ids[cell], dist[other])]
+
+        self.nodes = np.array(cells, dtype=np.int64).reshape(-1, 2)
+        self.edges = np.array(edges, dtype=np.float64).reshape(-1, 3)
+        self._index()
+        return self
+
+    def _index(self):
+        self.cells = [(int(x), int(y)) for x, y in self.nodes.tolist()]
+        self.node_ids = {cell: n for n, cell in enumerate(self.cells)}
+        self.adjacency = [[] for _ in range(len(self.nodes))]
+        for a, b, cost in self.edges.tolist():
+            self.adjacency[int(a)].append((int(b), cost))
+        self.cluster_nodes = {}
+        for cell, n in self.node_ids.items():
+            self.cluster_nodes.setdefault(self.cluster(cell), []).append(n)
+
+    def key(self):
+        digest = hashlib.sha256(np.ascontiguousarray(self.blocked).tobytes()).hexdigest()
+        return f'{HPA_VERSION}:{self.cluster_size}:{self.blocked.shape}:{digest}'
+
+    def save(self, cache_file):
+        tmp_file = cache_file + '.tmp.npz'
+        np.savez_compressed(tmp_file, key=self.key(), nodes=self.nodes, edges=self.edges)
+        os.replace(tmp_file, cache_file)
+
+    def load(self, cache_file) -> bool:
+        """
+        :return: False if there is no cache for this tile map and cluster size
+        """
+        try:
+            with np.load(cache_file) as cached:
+                if str(cached['key']) != self.key():
+                    return False
+                self.nodes, self.edges = cached['nodes'], cached['edges']
+        except (OSError, ValueError, KeyError):
+            return False
+        self._index()
+        return True
+
+    def connect(self, cell, stats=None):
+        """
+        Abstract edges between a cell and the entrances of its cluster.
+        :return: list of (node, cost), the local search from the cell
+        """
+        dist, parent = local_search(self.blocked, cell, self.bounds(self.cluster(cell)), stats=stats)
+        links = [(n, dist[self.cells[n]]) for n in self.cluster_nodes.get(self.cluster(cell), ())
+                 if self.cells[n] in dist]
+        return links, dist
+
+    def abstract_path(self, start, goal, goal_links=None, stats=None):
+        """
+        A* over the abstract graph with start and goal inserted as temporary nodes.
+        :param goal_links: connect(goal) result, can be reused for every query to the same goal
+        :param stats: dict, 'expanded' is increased by the cells and nodes expanded
+        :return: cells of the abstract path from start to goal, None if there is none
+        """
+        start, goal = tuple(start), tuple(goal)
+        start_links, start_dist = self.connect(start, stats)
+        links, goal_dist = goal_links or self.connect(goal, stats)
+        to_goal = dict(links)
+
+        s, g = len(self.cells), len(self.cells) + 1
+        gx, gy = goal
+
+        gscore = {s: 0.0}
+        came_from = {}
+        oheap = [(math.hypot(gx - start[0], gy - start[1]), s)]
+        closed = set()
+        while oheap:
+            _, current = heapq.heappop(oheap)
+            if current in closed:
+                continue
+            if current == g:
+                _count_expanded(stats, len(closed))
+                path = [g]
+                while path[-1] != s:
+                    path.append(came_from[path[-1]])
+                return [start] + [self.cells[n] for n in path[-2:0:-1]] + [goal]
+            closed.add(current)
+
+            if current == s:
+                successors = list(start_links)
+                if self.cluster(start) == self.cluster(goal) and goal in start_dist:
+                    successors.append((g, start_dist[goal]))
+            else:
+                successors = list(self.adjacency[current])
+                if current in to_goal:
+                    successors.append((g, to_goal[current]))
+
+            for neighbor, cost in successors:
+                tentative_g_score = gscore[current] + cost
+                if neighbor not in closed and tentative_g_score < gscore.get(neighbor, math.inf):
+                    gscore[neighbor] = tentative_g_score
+                    came_from[neighbor] = current
+                    x, y = goal if neighbor == g else self.cells[neighbor]
+                    heapq.heappush(oheap, (tentative_g_score + math.hypot(gx - x, gy - y), neighbor))
+        _count_expanded(stats, len(closed))
+        return None
+
+    def refine(self, a, b, occupied=None, stats=None):
+        """
+        Grid path between two consecutive cells of an abstract path, start excluded.
+        """
+        if max(abs(a[0] - b[0]), abs(a[1] - b[1])) <= 1:
+            return [b]
+        dist, parent = local_search(self.blocked, a, self.bounds(self.cluster(a)), target=b, occupied=occupied,
+                                    stats=stats)
+        return _trace(parent, a, b) if b in dist else None
+
+    def find_path(self, start, goal, occupied=None, first_step=False, goal_links=None, stats=None):
+        """
+        Same result format as simulation.astar.
+        :param occupied: cells taken by agents, only avoided while refining
+        :param first_step: refine only the first abstract edge
+        :param stats: dict, 'expanded' is increased by the cells and abstract nodes expanded
+        :return: path from the goal back to the first step (start excluded), [start] if there is none
+        """
+        start, goal = (int(start[0]), int(start[1])), (int(goal[0]), int(goal[1]))
+        if start == goal:
+            return [start]
+        abstract = self.abstract_path(start, goal, goal_links, stats)
+        if abstract is None:
+            return [start]
+
+        path = []
+        for a, b in zip(abstract, abstract[1:]):
+            if a == b:
+                continue
+            segment = self.refine(a, b, occupied if not path else None, stats)
+            if segment is None:
+                return [start]
+            path += segment
+            if first_step:
+                return [path[0]]
+        return path[::-1]
+
+
+def load_hpa(tile_map, cluster_size=10, cache_file=None):
+    """
+    HPA* abstraction of a tile map, cached on disk and rebuilt when the tile map or cluster size changes.
+    """
+    hpa = HPAStar(tile_map, cluster_size)
+    if cache_file is not None and hpa.load(cache_file):
+        return hpa
+    hpa.build()
+    if cache_file is not None:
+        os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+        hpa.save(cache_file)
+    return hpa
+
+
+class HPAPlanner:
+    """
+    HPA* queries towards one goal, with the goal already linked into the abstract graph.
+    """
+
+    def __init__(self, hpa, goal, stats=None):
+        """
+        :param stats: dict, 'expanded' is increased by the local search linking the goal
+        """
+        self.hpa = hpa
+        self.goal = (int(goal[0]), int(goal[1]))
+        self.goal_links = hpa.connect(self.goal, stats)
+
+    def next_step(self, position, occupied, stats=None):
+        """
+        :param occupied: cells taken right now, including moves made earlier in this tick
+        :param stats: dict, 'expanded' is increased by the cells and abstract nodes expanded
+        :return: next cell, the current one if the way is blocked
+        """
+        x, y = int(position[0]), int(position[1])
+        step = self.hpa.find_path((x, y), self.goal, occupied=occupied, first_step=True,
+                                  goal_links=self.goal_links, stats=stats)[0]
+        if step != (x, y) and occupied[step]:
+            return [x, y]
+        return list(step)
@@ -6,6 +6,9 @@ Anytime_D_star 2D
 import os
 import sys
 import math
+import heapq
+
+import numpy as np
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) +
                 "/../../Search_based_Planning/")
@@ -18,11 +21,14 @@ Env 2D
 
 class Env:
     def __init__(self, map):
-        self.x_range = len(map[0])  # size of background
-        self.y_range = len(map)
+        """
+        :param map: tile map indexed [x][y], 1 - obstacle (simulation TILE_MAP)
+        """
+        self.x_range = len(map)  # size of background
+        self.y_range = len(map[0])
         self.motions = [(-1, 0), (-1, 1), (0, 1), (1, 1),
                         (1, 0), (1, -1), (0, -1), (-1, -1)]
-        self.obs = map
+        self.obs = set((int(x), int(y)) for x, y in np.argwhere(np.asarray(map)))
 
     def update_obs(self, obs):
         self.obs = obs
@@ -73,15 +79,17 @@ class ADStar:
         self.y = self.Env.y_range
 
         self.g, self.rhs, self.OPEN = {}, {}, {}
+        # Binary heap over OPEN with lazy deletion: entries whose key no longer matches OPEN are skipped
+        self.open_heap = []
 
-        for i in range(1, self.Env.x_range - 1):
-            for j in range(1, self.Env.y_range - 1):
+        for i in range(self.Env.x_range):
+            for j in range(self.Env.y_range):
                 self.rhs[(i, j)] = float("inf")
                 self.g[(i, j)] = float("inf")
 
         self.rhs[self.s_goal] = 0.0
         self.eps = eps
-        self.OPEN[self.s_goal] = self.Key(self.s_goal)
+        self.push(self.s_goal, self.Key(self.s_goal))
         self.CLOSED, self.INCONS = set(), dict()
 
         self.visited = set()
@@ -100,8 +108,8 @@ class ADStar:
                 break
             self.eps -= 0.5
             self.OPEN.update(self.INCONS)
-            for s in self.OPEN:
-                self.OPEN[s] = self.Key(s)
+            self.INCONS = dict()
+            self.rekey()
             self.CLOSED = set()
             self.ComputeOrImprovePath()
             self.visited = set()
@@ -132,8 +140,8 @@ class ADStar:
                     if len(self.INCONS) == 0:
                         break
                     self.OPEN.update(self.INCONS)
-                    for s in self.OPEN:
-                        self.OPEN[s] = self.Key(s)
+                    self.INCONS = dict()
+                    self.rekey()
                     self.CLOSED = set()
                     self.ComputeOrImprovePath()
                     self.visited = set()
@@ -173,16 +181,21 @@ class ADStar:
                             break
                         self.eps -= 0.5
                         self.OPEN.update(self.INCONS)
-                        for s in self.OPEN:
-                            self.OPEN[s] = self.Key(s)
+                        self.INCONS = dict()
+                        self.rekey()
                         self.CLOSED = set()
                         self.ComputeOrImprovePath()
                         self.visited = set()
 
-    def ComputeOrImprovePath(self):
+    def ComputeOrImprovePath(self, converge=False):
+        """
+        :param converge: expand until OPEN is empty, making g exact for every state and not only s_start
+        """
         while True:
             s, v = self.TopKey()
-            if v >= self.Key(self.s_start) and \
+            if s is None:
+                break
+            if not converge and v >= self.Key(self.s_start) and \
                     self.rhs[self.s_start] == self.g[self.s_start]:
                 break
 
@@ -210,29 +223,48 @@ class ADStar:
 
         if self.g[s] != self.rhs[s]:
             if s not in self.CLOSED:
-                self.OPEN[s] = self.Key(s)
+                self.push(s, self.Key(s))
             else:
                 self.INCONS[s] = 0
 
     def Key(self, s):
         if self.g[s] > self.rhs[s]:
-            return [self.rhs[s] + self.eps * self.h(self.s_start, s), self.rhs[s]]
+            return (self.rhs[s] + self.eps * self.h(self.s_start, s), self.rhs[s])
         else:
-            return [self.g[s] + self.h(self.s_start, s), self.g[s]]
+            return (self.g[s] + self.h(self.s_start, s), self.g[s])
+
+    def push(self, s, key):
+        self.OPEN[s] = key
+        heapq.heappush(self.open_heap, (key, s))
+
+    def rekey(self):
+        """
+        Recomputes the keys of every OPEN state, after eps or s_start changed.
+        """
+        for s in self.OPEN:
+            self.OPEN[s] = self.Key(s)
+        self.open_heap = [(key, s) for s, key in self.OPEN.items()]
+        heapq.heapify(self.open_heap)
 
     def TopKey(self):
         """
         :return: return the min key and its value.
         """
 
-        s = min(self.OPEN, key=self.OPEN.get)
-        return s, self.OPEN[s]
+        while self.open_heap:
+            key, s = self.open_heap[0]
+            if self.OPEN.get(s) == key:
+                return s, key
+            heapq.heappop(self.open_heap)
+        return None, (float("inf"), float("inf"))
 
     def h(self, s_start, s_goal):
         heuristic_type = self.heuristic_type  # heuristic type
 
         if heuristic_type == "manhattan":
             return abs(s_goal[0] - s_start[0]) + abs(s_goal[1] - s_start[1])
+        elif heuristic_type == "zero":
+            return 0.0
         else:
             return math.hypot(s_goal[0] - s_start[0], s_goal[1] - s_start[1])
 
@@ -271,11 +303,49 @@ class ADStar:
         nei_list = set()
         for u in self.u_set:
             s_next = tuple([s[i] + u[i] for i in range(2)])
-            if s_next not in self.obs:
+            if 0 <= s_next[0] < self.x and 0 <= s_next[1] < self.y and s_next not in self.obs:
                 nei_list.add(s_next)
 
         return nei_list
 
+    def update_cells(self, blocked=(), freed=()):
+        """
+        Repairs the plan after cells became obstacles or free; only the affected states are re-expanded.
+        """
+        for s in blocked:
+            if s not in self.obs:
+                self.obs.add(s)
+                self.g[s] = float("inf")
+                self.rhs[s] = float("inf") if s != self.s_goal else 0.0
+                self.INCONS.pop(s, None)
+                self.UpdateState(s)
+                for sn in self.get_neighbor(s):
+                    self.UpdateState(sn)
+        for s in freed:
+            if s in self.obs:
+                self.obs.remove(s)
+                self.UpdateState(s)
+                for sn in self.get_neighbor(s):
+                    self.UpdateState(sn)
+
+    def replan(self, converge=False):
+        """
+        Repairs the path after update_cells (eps is not inflated here).
+        :param converge: bring every state to consistency, not only s_start
+        """
+        while True:
+            self.ComputeOrImprovePath(converge=converge)
+            self.visited = set()
+            if len(self.INCONS) == 0:
+                break
+            self.OPEN.update(self.INCONS)
+            self.INCONS = dict()
+            self.CLOSED = set()
+            self.rekey()
+
+    def converge(self):
+        self.replan(converge=True)
+
     def extract_path(self):
         """
         Extract the path based on the PARENT set.
@@ -298,12 +368,428 @@ class ADStar:
         return list(path)
 
 
+class IndexedHeap:
+    """
+    Binary min-heap of integer states with a position index,
+    so a key can be decreased, increased or removed in O(log n) without stale entries.
+    """
+
+    def __init__(self, size):
+        self.heap = []
+        self.keys = {}
+        self.pos = [-1] * size
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, s):
+        return self.pos[s] >= 0
+
+    def items(self):
+        return self.keys.items()
+
+    def top(self):
+        if not self.heap:
+            return None, (float("inf"), float("inf"))
+        s = self.heap[0]
+        return s, self.keys[s]
+
+    def push(self, s, key):
+        """
+        Inserts s or changes its key.
+        """
+        i = self.pos[s]
+        if i < 0:
+            self.keys[s] = key
+            self.heap.append(s)
+            self.pos[s] = len(self.heap) - 1
+            self._sift_up(len(self.heap) - 1)
+        else:
+            old = self.keys[s]
+            self.keys[s] = key
+            if key < old:
+                self._sift_up(i)
+            else:
+                self._sift_down(i)
+
+    def remove(self, s):
+        i = self.pos[s]
+        if i < 0:
+            return
+        last = self.heap.pop()
+        self.pos[s] = -1
+        del self.keys[s]
+        if i < len(self.heap):
+            self.heap[i] = last
+            self.pos[last] = i
+            self._sift_up(i)
+            self._sift_down(self.pos[last])
+
+    def rebuild(self, keys):
+        """
+        Replaces all keys at once in O(n).
+        """
+        for s in self.heap:
+            self.pos[s] = -1
+        self.keys = dict(keys)
+        self.heap = list(self.keys)
+        for i, s in enumerate(self.heap):
+            self.pos[s] = i
+        for i in reversed(range(len(self.heap) // 2)):
+            self._sift_down(i)
+
+    def _sift_up(self, i):
+        heap, pos, keys = self.heap, self.pos, self.keys
+        s = heap[i]
+        key = keys[s]
+        while i > 0:
+            parent = (i - 1) >> 1
+            p = heap[parent]
+            if not key < keys[p]:
+                break
+            heap[i] = p
+            pos[p] = i
+            i = parent
+        heap[i] = s
+        pos[s] = i
+
+    def _sift_down(self, i):
+        heap, pos, keys = self.heap, self.pos, self.keys
+        n = len(heap)
+        s = heap[i]
+        key = keys[s]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and keys[heap[child + 1]] < keys[heap[child]]:
+                child += 1
+            c = heap[child]
+            if not keys[c] < key:
+                break
+            heap[i] = c
+            pos[c] = i
+            i = child
+        heap[i] = s
+        pos[s] = i
+
+
+class GridADStar:
+    """
+    Array-backed Anytime D*, same algorithm and interface as ADStar.
+    States are flat indices into a grid padded with an obstacle border, so neighbours come from a
+    precomputed offset table without bounds checks; g and rhs are flat NumPy arrays, the obstacles a
+    boolean grid, and OPEN an IndexedHeap.
+    """
+
+    def __init__(self, map, s_start, s_goal, eps, heuristic_type, cut_corners=False):
+        """
+        :param cut_corners: allow diagonal moves between two obstacles sharing a corner, as astar and jps do;
+        ADStar never allows them
+        """
+        grid = np.asarray(map, dtype=bool)
+        self.x, self.y = grid.shape
+        self.stride = self.y + 2
+        size = (self.x + 2) * self.stride
+
+        obs = np.ones((self.x + 2, self.stride), dtype=bool)
+        obs[1:-1, 1:-1] = grid
+        self.obs = obs.ravel()
+
+        # (offset, cost, the two cells a diagonal move must not cut through)
+        self.motions = []
+        for dx, dy in Env(grid).motions:
+            corners = (dx * self.stride, dy) if dx and dy and not cut_corners else ()
+            self.motions.append((dx * self.stride + dy, math.hypot(dx, dy), corners))
+
+        self.g = np.full(size, np.inf)
+        self.rhs = np.full(size, np.inf)
+        self.OPEN = IndexedHeap(size)
+        self.CLOSED, self.INCONS = set(), set()
+
+        self.heuristic_type = heuristic_type
+        self.eps = eps
+        self.s_start, self.s_goal = s_start, s_goal
+        self.start, self.goal = self.index(s_start), self.index(s_goal)
+
+        self.rhs[self.goal] = 0.0
+        self.OPEN.push(self.goal, self.Key(self.goal))
+        self.count = 0
+
+    def index(self, s):
+        return (s[0] + 1) * self.stride + s[1] + 1
+
+    def state(self, i):
+        x, y = divmod(i, self.stride)
+        return x - 1, y - 1
+
+    def set_start(self, s_start):
+        self.s_start, self.start = s_start, self.index(s_start)
+        self.rekey()
+
+    def run(self):
+        self.ComputeOrImprovePath()
+
+        while True:
+            if self.eps <= 1.0:
+                break
+            self.eps -= 0.5
+            self.rekey(incons=True)
+            self.CLOSED = set()
+            self.ComputeOrImprovePath()
+
+    def ComputeOrImprovePath(self, converge=False):
+        """
+        :param converge: expand until OPEN is empty, making g exact for every state and not only s_start
+        """
+        g, rhs, OPEN = self.g, self.rhs, self.OPEN
+        while True:
+            s, v = OPEN.top()
+            if s is None:
+                break
+            if not converge and v >= self.Key(self.start) and rhs[self.start] == g[self.start]:
+                break
+
+            OPEN.remove(s)
+            self.count += 1
+
+            if g[s] > rhs[s]:
+                g[s] = rhs[s]
+                self.CLOSED.add(s)
+                for sn in self.get_neighbor(s):
+                    self.UpdateState(sn)
+            else:
+                g[s] = np.inf
+                for sn in self.get_neighbor(s):
+                    self.UpdateState(sn)
+                self.UpdateState(s)
+
+    def UpdateState(self, s):
+        g, rhs = self.g, self.rhs
+        if s != self.goal:
+            best = np.inf
+            obs = self.obs
+            if not obs[s]:
+                for offset, cost, corners in self.motions:
+                    x = s + offset
+                    if obs[x] or corners and (obs[s + corners[0]] or obs[s + corners[1]]):
+                        continue
+                    v = g[x] + cost
+                    if v < best:
+                        best = v
+            rhs[s] = best
+
+        if g[s] != rhs[s]:
+            if s not in self.CLOSED:
+                self.OPEN.push(s, self.Key(s))
+            else:
+                self.OPEN.remove(s)
+                self.INCONS.add(s)
+        else:
+            self.OPEN.remove(s)
+
+    def Key(self, s):
+        g, rhs = float(self.g[s]), float(self.rhs[s])
+        if g > rhs:
+            return rhs + self.eps * self.h(self.start, s), rhs
+        else:
+            return g + self.h(self.start, s), g
+
+    def rekey(self, incons=False):
+        """
+        Recomputes the keys of every OPEN state (and INCONS ones) after eps or s_start changed.
+        """
+        states = list(self.OPEN.keys)
+        if incons:
+            states += list(self.INCONS)
+            self.INCONS = set()
+        self.OPEN.rebuild({s: self.Key(s) for s in states})
+
+    def TopKey(self):
+        return self.OPEN.top()
+
+    def h(self, a, b):
+        if self.heuristic_type == "zero":
+            return 0.0
+        ax, ay = divmod(a, self.stride)
+        bx, by = divmod(b, self.stride)
+        if self.heuristic_type == "manhattan":
+            return abs(bx - ax) + abs(by - ay)
+        return math.hypot(bx - ax, by - ay)
+
+    def get_neighbor(self, s):
+        obs = self.obs
+        return [s + offset for offset, _, _ in self.motions if not obs[s + offset]]
+
+    def update_cells(self, blocked=(), freed=()):
+        """
+        Repairs the plan after cells became obstacles or free; only the affected states are re-expanded.
+        """
+        for cell in blocked:
+            s = self.index(cell)
+            if not self.obs[s]:
+                self.obs[s] = True
+                self.g[s] = np.inf
+                self.rhs[s] = np.inf if s != self.goal else 0.0
+                self.INCONS.discard(s)
+                self.UpdateState(s)
+                for sn in self.get_neighbor(s):
+                    self.UpdateState(sn)
+        for cell in freed:
+            s = self.index(cell)
+            if self.obs[s]:
+                self.obs[s] = False
+                self.UpdateState(s)
+                for sn in self.get_neighbor(s):
+                    self.UpdateState(sn)
+
+    def replan(self, converge=False):
+        """
+        Repairs the path after update_cells (eps is not inflated here).
+        :param converge: bring every state to consistency, not only s_start
+        """
+        while True:
+            self.ComputeOrImprovePath(converge=converge)
+            if len(self.INCONS) == 0:
+                break
+            self.rekey(incons=True)
+            self.CLOSED = set()
+
+    def converge(self):
+        self.replan(converge=True)
+
+    def g_of(self, s):
+        x, y = s
+        if not (0 <= x < self.x and 0 <= y < self.y):
+            return float("inf")
+        return float(self.g[self.index(s)])
+
+    def extract_path(self):
+        path = [self.s_start]
+        s = self.start
+
+        for k in range(self.x * self.y):
+            best, best_cost = None, np.inf
+            for offset, cost, corners in self.motions:
+                x = s + offset
+                if self.obs[x] or corners and (self.obs[s + corners[0]] or self.obs[s + corners[1]]):
+                    continue
+                if cost + self.g[x] < best_cost:
+                    best, best_cost = x, cost + self.g[x]
+            if best is None:
+                break
+            s = best
+            path.append(self.state(s))
+            if s == self.goal:
+                break
+
+        return list(path)
+
+
+class ADStarPlanner:
+    """
+    Goal-rooted AD* shared by all agents of a simulation.
+    Agents and closed cells are dynamic obstacles; every tick only the cells that changed are repaired,
+    then each agent steps to the free neighbour with the lowest cost-to-goal.
+    There is no single start to aim at, so the search runs with eps = 1 and no heuristic until consistent.
+    Moves follow the simulation grid: 8-connected, diagonals may pass between two obstacles, as in astar.
+    """
+
+    def __init__(self, tile_map, goal, state=None):
+        """
+        :param tile_map: static obstacles; agents are passed to update()
+        :param state: state() of a planner for the same goal, restored without searching again
+        """
+        self.goal = (int(goal[0]), int(goal[1]))
+        self.static = np.asarray(tile_map, dtype=bool).copy()
+        self.blocked = np.asarray(tile_map if state is None else state['blocked'], dtype=bool).copy()
+        self.motions = Env(self.blocked).motions
+        self.dstar = GridADStar(self.blocked, self.goal, self.goal, 1.0, "zero", cut_corners=True)
+        if state is None:
+            self.dstar.converge()
+        else:
+            # A saved planner is consistent: nothing is left in OPEN
+            self.dstar.OPEN.remove(self.dstar.goal)
+            self.dstar.g[:] = state['g']
+            self.dstar.rhs[:] = state['rhs']
+            self.dstar.CLOSED = set(np.flatnonzero(state['closed']).tolist())
+
+    def state(self) -> dict:
+        closed = np.zeros(len(self.dstar.g), dtype=bool)
+        closed[list(self.dstar.CLOSED)] = True
+        return {'blocked': self.blocked, 'g': self.dstar.g, 'rhs': self.dstar.rhs, 'closed': closed}
+
+    def update(self, blocked, static=None, stats=None):
+        """
+        :param blocked: current obstacle grid, static obstacles and agents
+        :param static: current static obstacles, if gates changed them since the planner was built
+        :param stats: dict, 'expanded' is increased by the number of states the repair expanded
+        """
+        if static is not None:
+            self.static = np.asarray(static, dtype=bool).copy()
+        blocked = np.array(blocked, dtype=bool)
+        # An agent on the goal must not cut the search off its root, only a wall can
+        blocked[self.goal] = self.static[self.goal]
+        changed = np.argwhere(blocked != self.blocked)
+        if len(changed) == 0:
+            return
+        cells = [(int(x), int(y)) for x, y in changed]
+        self.dstar.update_cells(blocked=[c for c in cells if blocked[c]],
+                                freed=[c for c in cells if not blocked[c]])
+        self.blocked = blocked
+        count = self.dstar.count
+        self.dstar.converge()
+        if stats is not None:
+            stats['expanded'] = stats.get('expanded', 0) + self.dstar.count - count
+
+    def cost_of(self, s, occupied):
+        """
+        Cost-to-goal of a cell without an agent right now.
+        A cell an agent left earlier in this tick is still an obstacle for the plan, with g = inf;
+        it is scored like rhs, by its best neighbour. Walls stay at inf.
+        """
+        if self.static[s]:
+            return float("inf")
+        if not self.blocked[s]:
+            return self.dstar.g_of(s)
+        x, y = s
+        best = float("inf")
+        for i, j in self.motions:
+            n = (x + i, y + j)
+            cost = self.dstar.g_of(n) + math.hypot(i, j)
+            if cost < best and not occupied[n]:
+                best = cost
+        return best
+
+    def next_step(self, position, occupied, stats=None):
+        """
+        Same choice as the first step of astar: the free neighbour on the shortest path around the other agents.
+        :param occupied: cells taken by agents right now, including moves made earlier in this tick
+        :param stats: unused, nothing is expanded here; update() counts the repairs
+        :return: next cell, the current one if the goal is unreachable
+        """
+        x, y = int(position[0]), int(position[1])
+        w, h = self.blocked.shape
+        best, best_cost = [x, y], float("inf")
+        for i, j in self.motions:
+            s = (x + i, y + j)
+            if not (0 <= s[0] < w and 0 <= s[1] < h) or occupied[s] or self.static[s]:
+                continue
+            cost = self.cost_of(s, occupied) + math.hypot(i, j)
+            if cost < best_cost:
+                best, best_cost = list(s), cost
+        return best
+
+
 def main():
     s_start = (5, 5)
     s_goal = (45, 25)
 
-    dstar = ADStar(s_start, s_goal, 2.5, "euclidean")
+    env = Env([[0] * 30 for _ in range(50)])
+    dstar = ADStar([[int((x, y) in env.obs_map()) for y in range(30)] for x in range(50)],
+                   s_start, s_goal, 2.5, "euclidean")
     dstar.run()
+    print(dstar.extract_path())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+import os
+import time
+
+import numpy as np
+
+PHASES = ('events', 'occupancy', 'planning', 'recording', 'arrivals', 'rendering')
+
+
+class TickProfiler:
+    """
+    Wall time of every phase of every tick, agent counts and search node expansions,
+    kept in preallocated arrays so that measuring costs a few perf_counter calls per tick.
+    """
+
+    def __init__(self, capacity=1024):
+        self.phase_index = {name: n for n, name in enumerate(PHASES)}
+        self.phase_seconds = np.zeros((capacity, len(PHASES)))
+        self.agents = np.zeros(capacity, dtype=np.int64)
+        self.expanded = np.zeros(capacity, dtype=np.int64)
+        self.ticks = 0
+        self.last = None
+
+    def start_tick(self):
+        if self.ticks == len(self.agents):
+            for name in ('phase_seconds', 'agents', 'expanded'):
+                old = getattr(self, name)
+                new = np.zeros((2 * len(old),) + old.shape[1:], dtype=old.dtype)
+                new[:len(old)] = old
+                setattr(self, name, new)
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        """
+        Adds the time since the previous lap to the phase.
+        """
+        now = time.perf_counter()
+        self.phase_seconds[self.ticks, self.phase_index[phase]] += now - self.last
+        self.last = now
+
+    def end_tick(self, agents, search_stats=None):
+        """
+        :param search_stats: dict the planners fill during the tick, it is emptied: cells expanded by astar / jps,
+        HPA* local searches and distance field sweeps (flow, social), abstract HPA* nodes and states of AD* repairs
+        """
+        self.agents[self.ticks] = agents
+        if search_stats:
+            self.expanded[self.ticks] = search_stats.pop('expanded', 0)
+        self.ticks += 1
+
+    def tick_seconds(self) -> np.ndarray:
+        return self.phase_seconds[:self.ticks].sum(axis=1)
+
+    def summary(self) -> dict:
+        seconds = self.tick_seconds()
+        if len(seconds) == 0:
+            return {}
+        p50, p95, p99 = np.percentile(seconds, (50, 95, 99)) * 1000
+        return {
+            "tick_ms": {"p50": p50, "p95": p95, "p99": p99, "max": float(seconds.max() * 1000)},
+            "phase_seconds": dict(zip(PHASES, self.phase_seconds[:self.ticks].sum(axis=0).tolist())),
+            "expanded": int(self.expanded[:self.ticks].sum()),
+            "peak_agents": int(self.agents[:self.ticks].max())
+        }
+
+    def save(self, metrics_file):
+        """
+        Per-tick metrics as a compressed npz: phase_seconds (T, P) with the phase names, agents and expanded (T,).
+        """
+        directory = os.path.dirname(metrics_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file = metrics_file + '.tmp.npz'
+        np.savez_compressed(tmp_file, phases=np.array(PHASES), phase_seconds=self.phase_seconds[:self.ticks],
+                            agents=self.agents[:self.ticks], expanded=self.expanded[:self.ticks])
+        os.replace(tmp_file, metrics_file)
@@ -0,0 +1,143 @@
+import numpy as np
+import pygame
+
+from colour import Color
+
+# Cells of this colour are left out when a layer is blitted
+TRANSPARENT = (0, 0, 0)
+
+
+def color_lut(start="yellow", end="red", steps=255) -> np.ndarray:
+    """
+    :return: (steps, 3) uint8 RGB lookup table of the colour range
+    """
+    return np.array([[int(x * 255) for x in c.rgb] for c in Color(start).range_to(Color(end), steps)],
+                    dtype=np.uint8)
+
+
+def cell_mask(cell_size, outline=False) -> np.ndarray:
+    """
+    Pixels of one grid cell that get painted: all of them, or the 1px border like pygame.draw.rect(..., 1).
+    """
+    mask = np.ones((cell_size, cell_size), dtype=bool)
+    if outline and cell_size > 2:
+        mask[1:-1, 1:-1] = False
+    return mask
+
+
+def cells_surface(rgb, cell_size, outline=False) -> pygame.Surface:
+    """
+    Scales a (W, H, 3) per-cell colour array up to GRID_CELL_SIZE pixels per cell.
+    TRANSPARENT cells are keyed out.
+    """
+    w, h = rgb.shape[:2]
+    pixels = np.repeat(np.repeat(rgb, cell_size, axis=0), cell_size, axis=1)
+    if outline:
+        pixels[~np.tile(cell_mask(cell_size, outline), (w, h))] = TRANSPARENT
+
+    surface = pygame.surfarray.make_surface(pixels)
+    if pygame.display.get_surface() is not None:
+        surface = surface.convert()
+    surface.set_colorkey(TRANSPARENT)
+    return surface
+
+
+def mask_surface(mask, color, cell_size, outline=False) -> pygame.Surface:
+    """
+    Layer with the cells where mask is set painted in one colour.
+    """
+    rgb = np.zeros((*np.shape(mask), 3), dtype=np.uint8)
+    rgb[np.asarray(mask, dtype=bool)] = color
+    return cells_surface(rgb, cell_size, outline)
+
+
+def heatmap_surface(values, max_value, lut, cell_size, outline=False) -> pygame.Surface:
+    """
+    Heatmap layer: every non-zero cell coloured by lut[int((len(lut) - 1) * value / max_value)].
+    """
+    rgb = np.zeros((*values.shape, 3), dtype=np.uint8)
+    if max_value > 0:
+        filled = values > 0
+        rgb[filled] = lut[((len(lut) - 1) * (values[filled] / max_value)).astype(int)]
+    return cells_surface(rgb, cell_size, outline)
+
+
+class LayerCache:
+    """
+    Pre-rendered layers, rebuilt only when the version of their source changes.
+    """
+
+    def __init__(self):
+        self.layers = {}
+
+    def get(self, name, version, build):
+        cached = self.layers.get(name)
+        if cached is None or cached[0] != version:
+            cached = (version, build())
+            self.layers[name] = cached
+        return cached[1]
+
+
+def static_scene(screen_size, draw_type, rects, tile_map, cell_size, settings,
+                 collider_color, tile_color, background=(255, 255, 255)) -> pygame.Surface:
+    """
+    Everything that does not change between frames: the SVG map, the colliders and the free tile grid,
+    according to the show_map / show_colliders / show_tile_map toggles.
+    """
+    surface = pygame.Surface(screen_size)
+    surface.fill(background)
+
+    if draw_type == 'svg' and settings['show_map']:
+        for rect in rects:
+            pygame.draw.rect(surface, rect[-1], (rect[0], rect[1]))
+
+    tile_map = np.asarray(tile_map)
+    if settings['show_colliders']:
+        surface.blit(mask_surface(tile_map != 0, collider_color, cell_size, outline=True), (0, 0))
+    if settings['show_tile_map']:
+        surface.blit(mask_surface(tile_map == 0, tile_color, cell_size, outline=True), (0, 0))
+    return surface
+
+
+def draw_agents(screen, agents, cell_size, color=(0, 0, 255)) -> list:
+    """
+    :return: screen rects of the drawn agents
+    """
+    return [pygame.draw.rect(screen, color, ((x * cell_size, y * cell_size), (cell_size, cell_size)))
+            for x, y in agents]
+
+
+class DirtyRenderer:
+    """
+    Blits a cached background once and afterwards only restores and updates the parts of the screen
+    that were drawn over it (agents, text), until the background changes.
+    """
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.background = None
+        self.full_update = True
+        self.restored = []
+        self.dirty = []
+
+    def begin(self, background):
+        if background is not self.background:
+            self.screen.blit(background, (0, 0))
+            self.background = background
+            self.full_update = True
+            self.restored = []
+        else:
+            for rect in self.dirty:
+                self.screen.blit(background, rect, rect)
+            self.full_update = False
+            self.restored = self.dirty
+        self.dirty = []
+
+    def mark(self, *rects):
+        self.dirty.extend(pygame.Rect(rect) for rect in rects)
+
+    def end(self):
+        if self.full_update:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.restored + self.dirty)
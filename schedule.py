@@ -0,0 +1,86 @@
+"""
+Timed events of a simulation, kept in a heap by tick.
+
+    {"tick": 0, "spawn": 0, "amount": 50}                   burst of 50 agents in spawn rect 0
+    {"tick": 100, "rate": 1, "per_tick": 0.5, "until": 400}  0.5 agents per tick in rect 1 until tick 400
+    {"tick": 200, "close": [10, 20, 3, 0]}                   gate cells x, y, w, h (edges included) become walls
+    {"tick": 300, "open": [10, 20, 3, 0]}                    and get their original tiles back
+
+Agents that found no free cell are retried every tick as a spawn event marked "retry": true.
+"""
+import heapq
+import itertools
+import json
+import os
+
+KINDS = ('spawn', 'rate', 'close', 'open')
+# Events due at the same tick: gates change the map before agents spawn on it
+PRIORITY = {'close': 0, 'open': 0, 'spawn': 1, 'rate': 1}
+
+
+def event_kind(event):
+    for kind in KINDS:
+        if kind in event:
+            return kind
+    raise ValueError(f'Unknown schedule event {event}, expected one of {KINDS}')
+
+
+class EventQueue:
+    def __init__(self, events=()):
+        self.heap = []
+        self.counter = itertools.count()
+        for event in events:
+            self.push(event)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, event):
+        heapq.heappush(self.heap, (int(event.get('tick', 0)), PRIORITY[event_kind(event)], next(self.counter), event))
+
+    def pop_due(self, tick) -> list:
+        """
+        :return: events due at or before the tick, in order
+        """
+        due = []
+        while self.heap and self.heap[0][0] <= tick:
+            due.append(heapq.heappop(self.heap)[-1])
+        return due
+
+    def scheduled(self) -> int:
+        """
+        :return: events still to come, retries of spawns that were due already not counted
+        """
+        return sum(1 for entry in self.heap if not entry[-1].get('retry'))
+
+    def drop_retries(self) -> int:
+        """
+        Gives up on the agents still waiting for a free cell.
+        :return: how many agents the dropped retries would have spawned
+        """
+        retries = [entry for entry in self.heap if entry[-1].get('retry')]
+        self.heap = [entry for entry in self.heap if not entry[-1].get('retry')]
+        heapq.heapify(self.heap)
+        return sum(int(entry[-1]['amount']) for entry in retries)
+
+    def events(self) -> list:
+        return [entry[-1] for entry in sorted(self.heap)]
+
+
+def default_schedule(rects, amount) -> list:
+    """
+    Everyone at once: a burst of amount agents in every spawn rect at tick 0.
+    """
+    return [{'tick': 0, 'spawn': n, 'amount': int(amount)} for n in range(len(rects))]
+
+
+def load_schedule(schedule):
+    """
+    :param schedule: list of events, a path to a JSON file with one, or None
+    """
+    if isinstance(schedule, str):
+        if not os.path.exists(schedule):
+            raise ValueError(f'Schedule file {schedule} does not exist')
+        with open(schedule, mode='r') as f:
+            return json.load(f)
+    return schedule
@@ -1,123 +1,506 @@
 import argparse
+import cProfile
 import heapq
-import itertools
 import json
-import random
+import math
+import os
+import pstats
 
 import sys
-
-from xml.dom import minidom
+import time
+from collections import OrderedDict
 
 import pygame.gfxdraw
 
 import numpy as np
 import pygame
 
-from os_activities import save_points, create_new_project
-from utilities import cv_col, get_rects, rect_collision, generate_tile_map, discrete_png
+from os_activities import open_trajectory_writer, checkpoint_path, save_checkpoint, load_checkpoint
+from agents import AgentStore
+from crowd import SocialForceCrowd, direction_field
+from profiling import TickProfiler
+from planning.HPAStar import HPAPlanner, load_hpa
+from planning.Star import ADStarPlanner
+from schedule import EventQueue, default_schedule, event_kind, load_schedule
+from rendering import LayerCache, DirtyRenderer, static_scene, draw_agents
+from utilities import load_model
 
 
-def intersects(point, colliders, collider_size=10):
-    x, y = point
-    x, y = x - collider_size // 2, y - collider_size // 2
-    w, h = collider_size, collider_size
-    s = any(map(lambda c:
-                rect_collision(((x, y), (w, h)), c), colliders
-                ))
-    return s
+NEIGHBORS = ((0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1))
+SQRT2 = math.sqrt(2)
 
 
 def heuristic(a, b):
     return np.sqrt((b[0] - a[0]) ** 2 + (b[1] - a[1]) ** 2)
 
 
-def astar(array, start, goal):
+def astar(array, start, goal, first_step=False, stats=None):
+    """
+    A* over the 8-connected tile grid.
+    g-scores and parents live in flat arrays indexed by x * h + y; the open set is a heap with lazy deletion.
+    :param first_step: return only the first step instead of the whole path; the search still runs to the goal,
+    only the path reconstruction stops early
+    :param stats: dict, 'expanded' is increased by the number of expanded nodes
+    :return: path from the goal back to the first step (start excluded), [start] if there is none
+    """
     if tuple(start) == tuple(goal):
         return [start]
-    neighbors = np.array(((0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)))
-    close_set = set()
-
-    start = tuple(start)
-    goal = tuple(goal)
+    w, h = array.shape
+    blocked = np.asarray(array, dtype=bool).ravel()
 
-    came_from = {}
-    gscore = {start: 0}
+    sx, sy = int(start[0]), int(start[1])
+    gx, gy = int(goal[0]), int(goal[1])
+    start_i, goal_i = sx * h + sy, gx * h + gy
 
-    fscore = {start: heuristic(start, goal)}
+    gscore = np.full(w * h, np.inf)
+    came_from = np.full(w * h, -1, dtype=np.int64)
+    closed = np.zeros(w * h, dtype=bool)
 
-    oheap = []
-    heapq.heappush(oheap, (fscore[start], start))
+    gscore[start_i] = 0.0
+    open_set = {start_i: 0.0}
+    oheap = [(math.hypot(gx - sx, gy - sy), start_i)]
+    expanded = 0
 
     while oheap:
-        current = heapq.heappop(oheap)[1]
-        if current == goal:
-            data = []
-            while current in came_from:
-                data.append(current)
-
-                current = came_from[current]
-            return data
-        close_set.add(current)
-
-        for i, j in neighbors:
-
-            neighbor = current[0] + i, current[1] + j
+        _, current = heapq.heappop(oheap)
+        if closed[current]:
+            continue
+        if current == goal_i:
+            _count_expanded(stats, expanded)
+            return _reconstruct_path(came_from, start_i, goal_i, h, first_step)
+        closed[current] = True
+        expanded += 1
+        g = open_set.pop(current)
+
+        x, y = divmod(current, h)
+        for i, j in NEIGHBORS:
+            nx, ny = x + i, y + j
+            if not (0 <= nx < w and 0 <= ny < h):
+                continue
+            neighbor = nx * h + ny
+            if blocked[neighbor] or closed[neighbor]:
+                continue
 
-            tentative_g_score = gscore[current] + heuristic(current, neighbor)
+            tentative_g_score = g + (SQRT2 if i and j else 1.0)
+            if tentative_g_score < gscore[neighbor]:
+                # Decrease-key: the stale heap entry is skipped once the neighbor is closed
+                came_from[neighbor] = current
+                gscore[neighbor] = tentative_g_score
+                open_set[neighbor] = tentative_g_score
+                heapq.heappush(oheap, (tentative_g_score + math.hypot(gx - nx, gy - ny), neighbor))
 
-            if 0 <= neighbor[0] < array.shape[0]:
+    _count_expanded(stats, expanded)
+    return [start]
 
-                if 0 <= neighbor[1] < array.shape[1]:
 
-                    if array[neighbor[0]][neighbor[1]] == 1:
-                        continue
+def _count_expanded(stats, expanded):
+    if stats is not None:
+        stats['expanded'] = stats.get('expanded', 0) + expanded
 
-                else:
 
-                    # array bound y walls
+def _reconstruct_path(came_from, start_i, goal_i, h, first_step=False):
+    data = []
+    current = goal_i
+    while current != start_i:
+        if not first_step:
+            data.append(divmod(int(current), h))
+        elif came_from[current] == start_i:
+            return [divmod(int(current), h)]
+        current = came_from[current]
+    return data
 
-                    continue
 
-            else:
+def _sign(v):
+    return (v > 0) - (v < 0)
 
-                # array bound x walls
 
-                continue
+def jps(array, start, goal, first_step=False, stats=None):
+    """
+    Jump Point Search: the same grid, moves and costs as astar, diagonal squeezes between two obstacles included.
+    Straight and diagonal runs without forced neighbours are jumped over, only jump points enter the open set.
+    The grid is a flat bytearray padded with a blocked border, so a move is one index offset without bounds checks.
+    :return: same path format as astar
+    """
+    if tuple(start) == tuple(goal):
+        return [start]
+    w, h = array.shape
+    H = h + 2
+    free = bytearray(np.pad(~np.asarray(array, dtype=bool), 1).tobytes())
+
+    sx, sy = int(start[0]), int(start[1])
+    gx, gy = int(goal[0]), int(goal[1])
+    start_i, goal_i = (sx + 1) * H + sy + 1, (gx + 1) * H + gy + 1
+
+    def jump_straight(i, d, side):
+        while True:
+            i += d
+            if not free[i]:
+                return -1
+            if i == goal_i or (free[i + d + side] and not free[i + side]) or \
+                    (free[i + d - side] and not free[i - side]):
+                return i
+
+    def jump(i, dx, dy):
+        if dx and dy:
+            d = dx * H + dy
+            while True:
+                i += d
+                if not free[i]:
+                    return -1
+                if i == goal_i or (free[i - dx * H + dy] and not free[i - dx * H]) or \
+                        (free[i + dx * H - dy] and not free[i - dy]):
+                    return i
+                if jump_straight(i, dx * H, 1) >= 0 or jump_straight(i, dy, H) >= 0:
+                    return i
+        if dx:
+            return jump_straight(i, dx * H, 1)
+        return jump_straight(i, dy, H)
+
+    def directions(i, parent):
+        if parent < 0:
+            return NEIGHBORS
+        x, y = divmod(i, H)
+        px, py = divmod(parent, H)
+        dx, dy = _sign(x - px), _sign(y - py)
+        if dx and dy:
+            result = [(0, dy), (dx, 0), (dx, dy)]
+            if not free[i - dx * H] and free[i - dx * H + dy]:
+                result.append((-dx, dy))
+            if not free[i - dy] and free[i + dx * H - dy]:
+                result.append((dx, -dy))
+        elif dx:
+            result = [(dx, 0)]
+            for side in (1, -1):
+                if not free[i + side] and free[i + dx * H + side]:
+                    result.append((dx, side))
+        else:
+            result = [(0, dy)]
+            for side in (1, -1):
+                if not free[i + side * H] and free[i + side * H + dy]:
+                    result.append((side, dy))
+        return result
+
+    gscore = {start_i: 0.0}
+    came_from = {start_i: -1}
+    closed = set()
+    oheap = [(math.hypot(gx - sx, gy - sy), start_i)]
+    expanded = 0
 
-            if neighbor in close_set and tentative_g_score >= gscore.get(neighbor, 0):
+    while oheap:
+        _, current = heapq.heappop(oheap)
+        if current in closed:
+            continue
+        if current == goal_i:
+            _count_expanded(stats, expanded)
+            return _reconstruct_jumps(came_from, goal_i, H, first_step)
+        closed.add(current)
+        expanded += 1
+
+        g = gscore[current]
+        x, y = divmod(current, H)
+        for dx, dy in directions(current, came_from[current]):
+            point = jump(current, dx, dy)
+            if point < 0 or point in closed:
                 continue
+            nx, ny = divmod(point, H)
+            n = max(abs(nx - x), abs(ny - y))
+            tentative_g_score = g + (n * SQRT2 if nx != x and ny != y else n)
+            if tentative_g_score < gscore.get(point, math.inf):
+                gscore[point] = tentative_g_score
+                came_from[point] = current
+                heapq.heappush(oheap, (tentative_g_score + math.hypot(gx - nx + 1, gy - ny + 1), point))
+
+    _count_expanded(stats, expanded)
+    return [start]
 
-            if tentative_g_score < gscore.get(neighbor, 0) or neighbor not in [i[1] for i in oheap]:
-                came_from[neighbor] = current
-
-                gscore[neighbor] = tentative_g_score
-
-                fscore[neighbor] = tentative_g_score + heuristic(neighbor, goal)
 
-                heapq.heappush(oheap, (fscore[neighbor], neighbor))
+def _reconstruct_jumps(came_from, goal_i, H, first_step=False):
+    """
+    Fills in the straight and diagonal runs between jump points, back from the goal.
+    """
+    data = []
+    current = goal_i
+    while came_from[current] >= 0:
+        x, y = divmod(current, H)
+        px, py = divmod(came_from[current], H)
+        dx, dy = _sign(px - x), _sign(py - y)
+        while (x, y) != (px, py):
+            data.append((x - 1, y - 1))
+            x, y = x + dx, y + dy
+        current = came_from[current]
+    return data[-1:] if first_step else data
+
+
+def trajectory(tile_map: np.ndarray, start: tuple, goal: tuple, first_step=False, search=None, stats=None) -> list:
+    """
+    :param search: astar (default) or jps
+    :param stats: passed to the search, counts expanded nodes
+    """
+    search = search or astar
+    return [list(start)] + list(map(list, search(tile_map, start, goal, first_step, stats=stats)[::-1]))
+
+
+def distance_field(tile_map: np.ndarray, goal: tuple, stats=None) -> np.ndarray:
+    """
+    Reverse Dijkstra sweep from the goal over the free tiles.
+    :param stats: dict, 'expanded' is increased by the number of expanded cells
+    :return: array of path costs to the goal, np.inf where the goal is unreachable
+    """
+    w, h = tile_map.shape
+    blocked = np.asarray(tile_map, dtype=bool).ravel()
+    dist = np.full(w * h, np.inf)
+
+    start = goal[0] * h + goal[1]
+    dist[start] = 0.0
+    oheap = [(0.0, start)]
+    expanded = 0
 
-    return [start]
+    while oheap:
+        d, current = heapq.heappop(oheap)
+        if d > dist[current]:
+            continue
+        expanded += 1
+        x, y = divmod(current, h)
+        for i, j in NEIGHBORS:
+            nx, ny = x + i, y + j
+            if not (0 <= nx < w and 0 <= ny < h):
+                continue
+            neighbor = nx * h + ny
+            if blocked[neighbor]:
+                continue
+            nd = d + (SQRT2 if i and j else 1.0)
+            if nd < dist[neighbor]:
+                dist[neighbor] = nd
+                heapq.heappush(oheap, (nd, neighbor))
+
+    _count_expanded(stats, expanded)
+    return dist.reshape(w, h)
+
+
+def flow_step(field: np.ndarray, tiles: np.ndarray, position) -> list:
+    """
+    Next cell for an agent following the distance field.
+    Occupied cells are skipped, so a blocked best neighbour falls back to the next best free one.
+    With no free cell downhill the agent sidesteps to the best free one less than a step uphill,
+    never straight back, so opposing streams of two goals pass each other instead of locking head-on.
+    """
+    x, y = position
+    w, h = field.shape
+    best, best_cost = [x, y], field[x][y]
+    side, side_cost = None, field[x][y] + 1.0
+    for i, j in NEIGHBORS:
+        nx, ny = x + i, y + j
+        if 0 <= nx < w and 0 <= ny < h and not tiles[nx][ny]:
+            if field[nx][ny] < best_cost:
+                best, best_cost = [nx, ny], field[nx][ny]
+            elif field[nx][ny] < side_cost:
+                side, side_cost = [nx, ny], field[nx][ny]
+    if side is not None and best[0] == x and best[1] == y:
+        return side
+    return best
+
+
+class GoalCache:
+    """
+    One routing structure per goal (a distance field or a planner), built on first use.
+    At most max_size of them are kept in memory; the least recently used one is dropped and rebuilt when needed.
+    """
+
+    def __init__(self, goals, build, max_size=16):
+        """
+        :param goals: (G, 2) goal cells
+        :param build: goal cell -> field or planner
+        """
+        self.goals = goals
+        self.build = build
+        self.max_size = max(int(max_size), 1)
+        self.items = OrderedDict()
+
+    def __getitem__(self, goal_id):
+        item = self.items.get(goal_id)
+        if item is None:
+            item = self.build(tuple(int(c) for c in self.goals[goal_id]))
+            self.items[goal_id] = item
+            if len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+        else:
+            self.items.move_to_end(goal_id)
+        return item
+
+    def precompute(self):
+        for goal_id in range(min(len(self.goals), self.max_size)):
+            self[goal_id]
+        return self
+
+    def values(self):
+        return list(self.items.values())
+
+    def state(self, encode) -> dict:
+        """
+        :param encode: cached item -> dict of arrays
+        :return: ids of the cached goals from least to most recently used, and the arrays of their items stacked
+        """
+        arrays = {'ids': np.array(list(self.items), dtype=np.int64)}
+        encoded = [encode(item) for item in self.items.values()]
+        for name in (encoded[0] if encoded else ()):
+            arrays[name] = np.stack([e[name] for e in encoded])
+        return arrays
+
+    def restore(self, arrays, decode):
+        """
+        :param decode: goal cell, arrays of one item -> item
+        """
+        self.items.clear()
+        names = [name for name in arrays if name != 'ids']
+        for n, goal_id in enumerate(arrays['ids'].tolist()):
+            self.items[goal_id] = decode(tuple(int(c) for c in self.goals[goal_id]),
+                                         {name: arrays[name][n] for name in names})
+        return self
+
+    def clear(self):
+        self.items.clear()
+
+
+def parse_goals(goal, tile_map=None, spawn_goals=None) -> np.ndarray:
+    """
+    :param goal: one [x, y] target or a list of them
+    :param tile_map: static obstacles, every goal must be a free cell of it
+    :param spawn_goals: per spawn rect, a goal id or weights over the goals, checked against them
+    :return: (G, 2) goal cells, the goal id of an agent indexes this array
+    """
+    goals = np.array(goal, dtype=np.int64).reshape(-1, 2)
+    if tile_map is not None:
+        tile_map = np.asarray(tile_map)
+        w, h = tile_map.shape
+        for x, y in goals.tolist():
+            if not (0 <= x < w and 0 <= y < h):
+                raise ValueError(f'Goal {[x, y]} is outside of the {w}x{h} grid')
+            if tile_map[x][y]:
+                raise ValueError(f'Goal {[x, y]} is on an obstacle')
+    for rect_id, weights in enumerate(spawn_goals or ()):
+        if weights is None or isinstance(weights, int):
+            if not 0 <= (weights or 0) < len(goals):
+                raise ValueError(f'Spawn rect {rect_id} heads to goal {weights}, there are {len(goals)} goals')
+        elif len(weights) != len(goals):
+            raise ValueError(f'Spawn rect {rect_id} has {len(weights)} goal weights for {len(goals)} goals')
+    return goals
+
+
+def pick_goals(weights, n, goals_amount=1, rng=None) -> np.ndarray:
+    """
+    :param weights: a goal id or weights over all the goals
+    :param rng: numpy Generator the goals are drawn with
+    :return: goal ids of n agents
+    """
+    if weights is None or isinstance(weights, int):
+        return np.full(n, weights or 0, dtype=np.int64)
+    p = np.asarray(weights, dtype=np.float64)
+    rng = rng if rng is not None else np.random.default_rng()
+    return rng.choice(goals_amount, size=n, p=p / p.sum()).astype(np.int64)
+
+
+def seed_sequence(seed) -> np.random.SeedSequence:
+    """
+    :param seed: int, [entropy, *spawn_key] for a substream of a sweep, or None for fresh entropy
+    """
+    if seed is None:
+        return np.random.SeedSequence()
+    if isinstance(seed, (list, tuple)):
+        return np.random.SeedSequence(int(seed[0]), spawn_key=tuple(int(k) for k in seed[1:]))
+    return np.random.SeedSequence(int(seed))
+
+
+def seed_value(sequence):
+    """
+    :return: the seed_sequence argument that gives this sequence back, as stored in meta
+    """
+    if sequence.spawn_key:
+        return [sequence.entropy, *sequence.spawn_key]
+    return sequence.entropy
+
+
+def rect_slices(rect, shape):
+    """
+    Grid slices of a rect x, y, w, h with both edges included, as the spawn rects are; None if it is off the grid.
+    """
+    x, y, w, h = (int(v) for v in rect[:4])
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w + 1, shape[0]), min(y + h + 1, shape[1])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return slice(x0, x1), slice(y0, y1)
+
+
+def free_spawn_cells(tile_map, positions, rect) -> np.ndarray:
+    """
+    :return: (K, 2) cells of the rect that are neither walls nor taken by an agent
+    """
+    slices = rect_slices(rect, tile_map.shape)
+    if slices is None:
+        return np.zeros((0, 2), dtype=np.int64)
+    (x0, x1), (y0, y1) = ((s.start, s.stop) for s in slices)
+    free = np.asarray(tile_map[slices]) == 0
+    inside = (positions[:, 0] >= x0) & (positions[:, 0] < x1) & (positions[:, 1] >= y0) & (positions[:, 1] < y1)
+    free[positions[inside, 0] - x0, positions[inside, 1] - y0] = False
+    return np.argwhere(free) + (x0, y0)
+
+
+def step_agents(store, goals, fields=None, planners=None, search=None, stats=None) -> int:
+    """
+    Moves every active agent of the AgentStore one cell towards its own goal, in slot order.
+    With more goals than the GoalCache of fields or planners holds, the agents go goal by goal instead,
+    in slot order within a goal, so every cached item is built at most once per tick.
+    The occupancy grid is updated as each agent moves, so later agents see the cells freed before them.
+    :param goals: (G, 2) goal cells indexed by the goal ids of the agents
+    :param fields: GoalCache of distance fields, for the flow planner
+    :param planners: GoalCache of ADStarPlanner or HPAPlanner, for the adstar and hpa planners
+    :param search: grid search for everything else, astar (default) or jps
+    :param stats: dict the grid search and the HPA* planners add their expanded node count to
+    :return: number of agents that kept their cell
+    """
+    stuck = 0
+    slots = store.active_slots()
+    cache = fields if fields is not None else planners
+    if cache is not None and len(goals) > cache.max_size:
+        slots = slots[np.argsort(store.goals[slots], kind='stable')]
+    for slot in slots:
+        x, y = store.positions[slot]
+        goal_id = store.goals[slot]
+        if fields is not None:
+            nx, ny = flow_step(fields[goal_id], store.occupancy, (x, y))
+        elif planners is not None:
+            nx, ny = planners[goal_id].next_step((x, y), store.occupancy, stats=stats)
+        else:
+            nx, ny = trajectory(store.blocked, (x, y), goals[goal_id], first_step=True, search=search,
+                                stats=stats)[1]
+        if nx == x and ny == y:
+            stuck += 1
+        else:
+            store.move(slot, nx, ny)
+    return stuck
 
 
-def trajectory(tile_map: np.ndarray, start: tuple, goal: tuple) -> list:
-    return [list(start)] + list(map(list, astar(tile_map, start, goal)[::-1]))
+def adstar_planner(store, goal, stats=None):
+    """
+    ADStarPlanner over the static map of the store, updated to the cells its agents take now.
+    :param stats: dict, 'expanded' is increased by the states of the initial search and the update
+    """
+    planner = ADStarPlanner(store.static, goal)
+    _count_expanded(stats, planner.dstar.count)
+    planner.update(store.blocked, stats=stats)
+    return planner
 
 
-def get_next_positions(tile_map=None, agents=None, goal=None) -> list:
-    tiles = tile_map.copy()
-    s = []
-    for passenger in agents:
-        next_point = trajectory(tiles, passenger, goal)[1]
-        s += [next_point]
-        tiles[next_point[0]][next_point[1]] = 1
-    return s
+def checkpoint_section(arrays, name) -> dict:
+    """
+    :return: the checkpoint arrays saved as name.key, by key
+    """
+    prefix = name + '.'
+    return {key[len(prefix):]: value for key, value in arrays.items() if key.startswith(prefix)}
 
 
-def tile_map_with_passengers(tile_map: np.ndarray, passengers: np.ndarray) -> np.ndarray:
-    tiles = tile_map.copy()
-    for (i, j) in passengers:
-        tiles[i][j] = 1
-    return tiles
+def hpa_cache_path(project_name, model_filename, grid_size, cluster_size):
+    return f"Projects/{project_name}/Cache/{model_filename}.{grid_size[0]}x{grid_size[1]}.c{cluster_size}.hpa.npz"
 
 
 def run_simulation(project_name,
@@ -131,45 +514,105 @@ def run_simulation(project_name,
                    FONT_NAME='Arial',
                    AGENTS_AMOUNT=30,
                    PASSENGERS_SPAWN_RECTS=((25, 45, 12, 2),),
-                   goal=(1, 1)):
-    PASSENGERS = np.array(tuple(set(tuple(tuple(((random.randint(rect[0], rect[0] + rect[2]),
-                                                  random.randint(rect[1], rect[1] + rect[3])) for _ in
-                                                 range(AGENTS_AMOUNT))) for rect
-                                          in PASSENGERS_SPAWN_RECTS)[0])))
-
-    if MODEL_FILENAME.endswith('.svg'):
-        DRAW_TYPE = 'svg'
-        rects = get_rects(
-            f"Projects/{project_name}/Models/{MODEL_FILENAME}",
-            svg_delta=SVG_DELTA,
-            svg_scale=SVG_SCALE
-        )
-        TILE_MAP = generate_tile_map(rects, GRID_SIZE, GRID_CELL_SIZE)
-
-        obstacles = tuple(
-            tuple((x, y) if intersects(
-                (x * GRID_CELL_SIZE, y * GRID_CELL_SIZE), rects) else None for y in range(len(TILE_MAP[0]))) for x in
-            range(len(TILE_MAP)))
+                   goal=(1, 1),
+                   SPAWN_GOALS=None,
+                   MAX_FIELDS=16,
+                   PLANNER='astar',
+                   HPA_CLUSTER_SIZE=10,
+                   ENGINE='grid',
+                   SCHEDULE=None,
+                   HEADLESS=False,
+                   RENDER_EVERY=1,
+                   MAX_TICKS=None,
+                   STALL_TICKS=1000,
+                   METRICS=None,
+                   SEED=None,
+                   CHECKPOINT_EVERY=None,
+                   RESUME=False,
+                   MODEL=None):
+    """
+    Runs the simulation until every agent reaches the goal and nothing is scheduled, or the window is closed.
+    With sim_name=None nothing is recorded.
+    :param goal: one [x, y] target for everyone, or a list of targets (exits, platforms, turnstiles)
+    :param SPAWN_GOALS: per spawn rect, a goal id or weights over the goals the agents of that rect head to
+    :param MAX_FIELDS: how many per-goal distance fields or planners are kept in memory at once
+    :param HPA_CLUSTER_SIZE: cluster side in cells for the hpa planner
+    :param ENGINE: 'grid' - one cell per tick with the chosen PLANNER, 'social' - continuous social-force crowd
+    :param SCHEDULE: timed spawn, arrival rate and gate events (see schedule.py), or a JSON file with them;
+    by default AGENTS_AMOUNT agents appear in every spawn rect at tick 0
+    :param HEADLESS: step without a display, at full CPU speed
+    :param RENDER_EVERY: draw only every N-th tick
+    :param MAX_TICKS: stop after this many ticks even if agents are left
+    :param STALL_TICKS: stop once no agent has arrived for this many ticks and nothing is scheduled, None to wait forever
+    :param SEED: seed of every random draw of the run (see seed_sequence); a fresh one is stored in meta when None
+    :param METRICS: npz file for the per-tick phase timings, agent counts and expanded nodes (see profiling.py)
+    :param CHECKPOINT_EVERY: save the whole run state every N ticks and when it stops early, next to the recording
+    :param RESUME: continue from the checkpoint of sim_name instead of starting over
+    :param MODEL: already discretized model (utilities.load_model result), shared between sweep runs
+    :return: summary stats of the run
+    """
+    if MODEL is None:
+        MODEL = load_model(project_name, MODEL_FILENAME, GRID_SIZE, GRID_CELL_SIZE,
+                           svg_scale=SVG_SCALE, svg_delta=SVG_DELTA)
+    DRAW_TYPE, rects, BASE_MAP, obstacles, GRID_SIZE = MODEL
+    GOALS = parse_goals(goal, BASE_MAP, SPAWN_GOALS)
+
+    checkpoint_file = None
+    if sim_name is not None:
+        checkpoint_file = checkpoint_path(f"Projects/{project_name}/Simulations/{sim_name}")
+    checkpoint = None
+    if RESUME:
+        if checkpoint_file is None:
+            raise ValueError('Only a recorded simulation can be resumed, sim_name is required')
+        saved, checkpoint = load_checkpoint(checkpoint_file)
+        # Same seed as the interrupted run, so the meta matches and the random draws continue its stream
+        SEED = checkpoint['meta']['SEED']
+    elif checkpoint_file is not None and os.path.exists(checkpoint_file):
+        # The recording it belongs to is overwritten now
+        os.remove(checkpoint_file)
+
+    SEED = seed_sequence(SEED)
+    RNG = np.random.default_rng(SEED)
+    SCHEDULE = load_schedule(SCHEDULE)
+    if checkpoint is not None:
+        RNG.bit_generator.state = checkpoint['rng']
+        EVENTS = EventQueue(checkpoint['events'])
     else:
-        DRAW_TYPE = 'png'
-        # background_img = pygame.image.load(f"Projects/{project_name}/Models/bg-{MODEL_FILENAME}").convert_alpha()
-
-        TILE_MAP = discrete_png(
-            f"Projects/{project_name}/Models/{MODEL_FILENAME}",
-            GRID_SIZE,
-            image_delta=SVG_DELTA,
-            image_scale=SVG_SCALE
-        )
-        GRID_SIZE = TILE_MAP.shape
-        obstacles = tuple(
-            tuple((i, j) if TILE_MAP[i][j] else None for j in range(len(TILE_MAP[0]))) for i in
-            range(len(TILE_MAP)))
-
-    obstacles = list(filter(lambda x: x is not None, itertools.chain(*obstacles)))
-    pygame.init()
-    font = pygame.font.SysFont(FONT_NAME, 20)
-    screen = pygame.display.set_mode(SCREEN_SIZE)
-    clock = pygame.time.Clock()
+        EVENTS = EventQueue(SCHEDULE if SCHEDULE is not None else default_schedule(PASSENGERS_SPAWN_RECTS,
+                                                                                     AGENTS_AMOUNT))
+
+    # Gates change the tiles during the run; the model itself may be shared with other runs
+    TILE_MAP = np.array(BASE_MAP if checkpoint is None else saved['tile_map'], dtype=int)
+
+    # Expanded nodes of every search, sweep and repair of the tick, for the profiler
+    search_stats = {}
+    # One sweep per goal replaces a search per agent per tick
+    FIELDS = None
+    if PLANNER == 'flow':
+        FIELDS = GoalCache(GOALS, lambda g: distance_field(TILE_MAP, g, stats=search_stats), MAX_FIELDS)
+    # Per agent grid search for astar and jps
+    SEARCH = jps if PLANNER == 'jps' else astar
+    PLANNERS = None
+    if PLANNER == 'adstar':
+        # Goal-rooted AD* per goal, repaired as agents move instead of searching again for every agent;
+        # one built after an eviction starts from the current occupancy, as the cached ones were updated to it
+        PLANNERS = GoalCache(GOALS, lambda g: adstar_planner(AGENTS, g, search_stats), MAX_FIELDS)
+    if PLANNER == 'hpa':
+        # Cluster abstraction of the static map, built once per model and grid and kept in the project cache;
+        # a run resumed with gates closed builds its own
+        HPA = load_hpa(TILE_MAP, HPA_CLUSTER_SIZE,
+                       hpa_cache_path(project_name, MODEL_FILENAME, TILE_MAP.shape, HPA_CLUSTER_SIZE)
+                       if np.array_equal(TILE_MAP, BASE_MAP) else None)
+        PLANNERS = GoalCache(GOALS, lambda g: HPAPlanner(HPA, g, search_stats), MAX_FIELDS)
+
+    if not HEADLESS:
+        pygame.init()
+        font = pygame.font.SysFont(FONT_NAME, 20)
+        screen = pygame.display.set_mode(SCREEN_SIZE)
+        clock = pygame.time.Clock()
+        # Map, colliders and tile grid are pre-rendered per toggle; only agents and text are redrawn
+        layers = LayerCache()
+        renderer = DirtyRenderer(screen)
     running = True
 
     settings = {'show_colliders': True,
@@ -177,95 +620,241 @@ def run_simulation(project_name,
                 'show_tile_map': False,
                 'show_passengers': True}
 
-    simulation_filename = f"Projects/{project_name}/Simulations/{sim_name}"
+    meta = {
+        "SCREEN_SIZE": SCREEN_SIZE,
+        "GRID_SIZE": GRID_SIZE,
+        "GRID_CELL_SIZE": GRID_CELL_SIZE,
+        "SVG_SCALE": SVG_SCALE,
+        "SVG_DELTA": SVG_DELTA,
+        "MODEL_FILENAME": MODEL_FILENAME,
+        "FONT_NAME": FONT_NAME,
+        "GOALS": GOALS.tolist(),
+        "SEED": seed_value(SEED)
+    }
+    # Parameters that are not in meta but change what the saved state means
+    run = json.loads(json.dumps({"PLANNER": PLANNER, "ENGINE": ENGINE, "PASSENGERS_SPAWN_RECTS": PASSENGERS_SPAWN_RECTS,
+                                 "SPAWN_GOALS": SPAWN_GOALS, "HPA_CLUSTER_SIZE": HPA_CLUSTER_SIZE}))
+    if checkpoint is not None and (json.loads(json.dumps(meta)) != checkpoint['meta'] or run != checkpoint['run']):
+        raise ValueError(f'Checkpoint {checkpoint_file} was saved by a run with other parameters')
+
+    recorder = None
+    if sim_name is not None:
+        simulation_filename = f"Projects/{project_name}/Simulations/{sim_name}"
+        recorder = open_trajectory_writer(simulation_filename, meta,
+                                          resume=checkpoint_section(saved, 'recorder') if checkpoint else None)
+
+    DIRECTIONS = None
+    if ENGINE == 'social':
+        # Agents follow the descent direction of the distance field of their goal
+        DIRECTIONS = GoalCache(GOALS, lambda g: direction_field(distance_field(TILE_MAP, g, stats=search_stats)),
+                               MAX_FIELDS)
+        AGENTS = SocialForceCrowd(TILE_MAP, DIRECTIONS)
+    else:
+        AGENTS = AgentStore(TILE_MAP, capacity=max(int(AGENTS_AMOUNT), 1))
+
+    # Routing caches kept in checkpoints, with item -> arrays and goal cell, arrays -> item;
+    # HPA* planners only link their goal to the abstraction and are built again
+    CACHES = {}
+    if FIELDS is not None:
+        CACHES['fields'] = FIELDS, lambda field: {'field': field}, lambda g, arrays: arrays['field']
+    if DIRECTIONS is not None:
+        CACHES['directions'] = DIRECTIONS, lambda field: {'field': field}, lambda g, arrays: arrays['field']
+    if PLANNER == 'adstar':
+        CACHES['adstar'] = (PLANNERS, lambda planner: planner.state(),
+                            lambda g, arrays: ADStarPlanner(TILE_MAP, g, state=arrays))
+    restored = []
+    if checkpoint is not None:
+        AGENTS.restore(checkpoint_section(saved, 'agents'))
+        for name, (cache, _, decode) in CACHES.items():
+            restored.append(cache.restore(checkpoint_section(saved, name), decode))
+    for cache in (FIELDS, PLANNERS, DIRECTIONS):
+        if cache is not None and not any(cache is r for r in restored):
+            cache.precompute()
+
+    def spawn(rect_id, amount):
+        """
+        Places up to amount agents on free cells of a spawn rect.
+        :return: agents left to place once cells free up, 0 if the rect has no free tiles at all
+        """
+        nonlocal unspawned
+        rect = PASSENGERS_SPAWN_RECTS[rect_id]
+        cells = free_spawn_cells(TILE_MAP, AGENTS.active_positions(), rect)
+        n = min(amount, len(cells))
+        if n:
+            cells = cells[RNG.choice(len(cells), size=n, replace=False)]
+            AGENTS.add(cells, pick_goals(SPAWN_GOALS[rect_id] if SPAWN_GOALS is not None else 0, n, len(GOALS), RNG))
+        slices = rect_slices(rect, TILE_MAP.shape)
+        if slices is None or not (TILE_MAP[slices] == 0).any():
+            unspawned += amount - n
+            return 0
+        return amount - n
+
+    def save_state():
+        arrays = {'tile_map': TILE_MAP, 'evacuated_by_goal': evacuated_by_goal, 'density_map': density_map}
+        for name, state in (('agents', AGENTS.state()), ('recorder', recorder.state())):
+            arrays.update({f'{name}.{key}': value for key, value in state.items()})
+        for name, (cache, encode, _) in CACHES.items():
+            arrays.update({f'{name}.{key}': value for key, value in cache.state(encode).items()})
+        save_checkpoint(checkpoint_file, arrays, {
+            'meta': meta, 'run': run, 'tick': tick, 'unspawned': unspawned, 'map_version': map_version,
+            'stuck': stuck, 'rng': RNG.bit_generator.state, 'events': EVENTS.events()})
+
+    unspawned = 0
+    map_version = 0
+    evacuated_by_goal = np.zeros(len(GOALS), dtype=np.int64)
+    density_map = np.zeros(TILE_MAP.shape, dtype=np.int64)
+    stuck = 0
+    tick = 0
+    if checkpoint is not None:
+        unspawned, map_version, stuck, tick = (checkpoint[k] for k in ('unspawned', 'map_version', 'stuck', 'tick'))
+        evacuated_by_goal, density_map = saved['evacuated_by_goal'], saved['density_map']
+    first_tick = tick
+    last_arrival = tick
+    profiler = TickProfiler()
+    # Fields and planners built before the first tick are not part of it
+    search_stats.clear()
+    started = time.perf_counter()
     while running:
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_q:
-                    sys.exit()
-                if event.key == pygame.K_w:
-                    settings['show_colliders'] = not settings['show_colliders']
-                if event.key == pygame.K_e:
-                    settings['show_map'] = not settings['show_map']
-                if event.key == pygame.K_r:
-                    settings['show_tile_map'] = not settings['show_tile_map']
-
-        # Make white screen background
-        screen.fill((255, 255, 255))
-
-        # Draw map
-
-        if DRAW_TYPE == 'svg':
-            if settings['show_map']:
-                for rect in rects:
-                    pygame.draw.rect(screen, rect[-1], (rect[0], rect[1]))
+        render = not HEADLESS and tick % RENDER_EVERY == 0
+        profiler.start_tick()
+
+        if not HEADLESS:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_q:
+                        running = False
+                    if event.key == pygame.K_w:
+                        settings['show_colliders'] = not settings['show_colliders']
+                    if event.key == pygame.K_e:
+                        settings['show_map'] = not settings['show_map']
+                    if event.key == pygame.K_r:
+                        settings['show_tile_map'] = not settings['show_tile_map']
+
+        for event in EVENTS.pop_due(tick):
+            kind = event_kind(event)
+            if kind in ('close', 'open'):
+                slices = rect_slices(event[kind], TILE_MAP.shape)
+                if slices is not None:
+                    TILE_MAP[slices] = 1 if kind == 'close' else BASE_MAP[slices]
+                    AGENTS.set_static(TILE_MAP)
+                    for cache in (FIELDS, DIRECTIONS):
+                        if cache is not None:
+                            cache.clear()
+                    if PLANNER == 'hpa':
+                        HPA = load_hpa(TILE_MAP, HPA_CLUSTER_SIZE)
+                        PLANNERS.clear()
+                    map_version += 1
+            elif kind == 'spawn':
+                left = spawn(event['spawn'], int(event['amount']))
+                if left:
+                    EVENTS.push(dict(event, tick=tick + 1, amount=left, retry=True))
+            else:
+                # Fractions of an agent and agents without a free cell carry over to the next tick
+                due = event.get('carry', 0.0) + float(event['per_tick'])
+                carry = due - int(due) + spawn(event['rate'], int(due))
+                if event.get('until') is None or tick + 1 < event['until']:
+                    EVENTS.push(dict(event, tick=tick + 1, carry=carry))
+                elif int(carry):
+                    EVENTS.push({'tick': tick + 1, 'spawn': event['rate'], 'amount': int(carry), 'retry': True})
+        profiler.lap('events')
+
+        if render:
+            renderer.begin(layers.get(
+                'static', (settings['show_map'], settings['show_colliders'], settings['show_tile_map'], map_version),
+                lambda: static_scene(SCREEN_SIZE, DRAW_TYPE, rects, TILE_MAP, GRID_CELL_SIZE, settings,
+                                     collider_color=(0, 255, 0), tile_color=(0, 0, 255))))
+            if settings['show_passengers']:
+                renderer.mark(*draw_agents(screen, AGENTS.active_positions(), GRID_CELL_SIZE))
+        profiler.lap('rendering')
+
+        if ENGINE == 'social':
+            stuck += AGENTS.step()
         else:
-            pass
-            # screen.blit(background_img, SVG_DELTA)
-
-        # Draw colliders
-        if settings['show_colliders']:
-            for c in obstacles:
-                x, y = c
-                rect = ((x * GRID_CELL_SIZE, y * GRID_CELL_SIZE),
-                        (GRID_CELL_SIZE, GRID_CELL_SIZE))
-                pygame.draw.rect(screen, (0, 255, 0), rect, 1)
-
-        pos = pygame.mouse.get_pos()
-        pos = tuple(x // GRID_CELL_SIZE for x in pos)
-
-        if settings['show_tile_map']:
-            for x in range(GRID_SIZE[0]):
-                for y in range(GRID_SIZE[1]):
-                    if TILE_MAP[x][y] == 0:
-                        rect = ((x * GRID_CELL_SIZE, y * GRID_CELL_SIZE),
-                                (GRID_CELL_SIZE, GRID_CELL_SIZE))
-                        pygame.draw.rect(screen, (0, 0, 255), rect, 1)
-
-        if settings['show_passengers']:
-            for x, y in PASSENGERS:
-                rect = ((x * GRID_CELL_SIZE, y * GRID_CELL_SIZE),
-                        (GRID_CELL_SIZE, GRID_CELL_SIZE))
-
-                pygame.draw.rect(screen,
-                                 (0, 0, 255),
-                                 rect
-                                 )
-
-        PASSENGERS = get_next_positions(
-            tile_map=tile_map_with_passengers(TILE_MAP, PASSENGERS),
-            agents=PASSENGERS,
-            goal=goal
-        )
-
-        meta = {
-            "SCREEN_SIZE": SCREEN_SIZE,
-            "GRID_SIZE": GRID_SIZE,
-            "GRID_CELL_SIZE": GRID_CELL_SIZE,
-            "SVG_SCALE": SVG_SCALE,
-            "SVG_DELTA": SVG_DELTA,
-            "MODEL_FILENAME": MODEL_FILENAME,
-            "FONT_NAME": FONT_NAME
-        }
-        save_points(list(map(lambda x: (x[0].item(), x[1].item()), PASSENGERS)), meta, simulation_filename)
-
-        for passenger in PASSENGERS:
-            if heuristic(passenger, goal) < 3:
-                PASSENGERS.remove(passenger)
-
-        if len(PASSENGERS) == 0:
-            sys.exit()
-
-        text_to_show = font.render(f"{int(clock.get_fps())} {pos} | Agents-amount: {len(PASSENGERS)}", 0, (0, 0, 0))
-        screen.blit(text_to_show, (10, 10))
-
-        pygame.gfxdraw.circle(screen, goal[0] * GRID_CELL_SIZE, goal[1] * GRID_CELL_SIZE, 30, (255, 0, 255))
-        pygame.display.flip()
-
-    pygame.quit()
+            if PLANNER == 'adstar':
+                for planner in PLANNERS.values():
+                    planner.update(AGENTS.blocked, AGENTS.static, stats=search_stats)
+                profiler.lap('occupancy')
+            stuck += step_agents(AGENTS, GOALS, fields=FIELDS, planners=PLANNERS, search=SEARCH, stats=search_stats)
+        profiler.lap('planning')
+
+        positions = AGENTS.active_positions()
+        if recorder is not None:
+            recorder.write(positions.tolist(), AGENTS.active_ids())
+        profiler.lap('recording')
+        np.add.at(density_map, (positions[:, 0], positions[:, 1]), 1)
+        profiler.lap('occupancy')
+        tick += 1
+
+        slots = AGENTS.active_slots()
+        targets = GOALS[AGENTS.goals[slots]]
+        arrived = np.hypot(positions[:, 0] - targets[:, 0], positions[:, 1] - targets[:, 1]) < 3
+        np.add.at(evacuated_by_goal, AGENTS.goals[slots[arrived]], 1)
+        AGENTS.remove(slots[arrived])
+        if arrived.any():
+            last_arrival = tick
+        profiler.lap('arrivals')
+
+        # Agents that cannot reach their goals would otherwise keep the run going forever,
+        # as would the retries of a spawn whose cells they never leave
+        stalled = EVENTS.scheduled() == 0 and STALL_TICKS is not None and tick - last_arrival >= STALL_TICKS
+        if stalled:
+            unspawned += EVENTS.drop_retries()
+        if (len(AGENTS) == 0 and len(EVENTS) == 0) or (MAX_TICKS is not None and tick >= MAX_TICKS) or stalled:
+            running = False
+        if running and recorder is not None and CHECKPOINT_EVERY and tick % CHECKPOINT_EVERY == 0:
+            save_state()
+            profiler.lap('recording')
+
+        if render:
+            pos = pygame.mouse.get_pos()
+            pos = tuple(x // GRID_CELL_SIZE for x in pos)
+            text_to_show = font.render(f"{int(clock.get_fps())} {pos} | Agents-amount: {len(AGENTS)}", 0, (0, 0, 0))
+            renderer.mark(screen.blit(text_to_show, (10, 10)))
+
+            for gx, gy in GOALS.tolist():
+                pygame.gfxdraw.circle(screen, gx * GRID_CELL_SIZE, gy * GRID_CELL_SIZE, 30, (255, 0, 255))
+                renderer.mark((gx * GRID_CELL_SIZE - 30, gy * GRID_CELL_SIZE - 30, 61, 61))
+            renderer.end()
+        if not HEADLESS:
+            clock.tick()
+        profiler.lap('rendering')
+        profiler.end_tick(len(positions), search_stats)
+
+    done = len(AGENTS) == 0 and len(EVENTS) == 0
+    if recorder is not None:
+        if done and os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+        elif not done and CHECKPOINT_EVERY:
+            # Closed window, MAX_TICKS or a stall: the run can be resumed from here
+            save_state()
+        recorder.close()
+    if not HEADLESS:
+        pygame.quit()
+
+    elapsed = time.perf_counter() - started
+    if METRICS is not None:
+        profiler.save(METRICS)
+    return {
+        "seed": seed_value(SEED),
+        "ticks": tick,
+        "agents": int(AGENTS.next_id),
+        "unspawned": unspawned,
+        "evacuated": int(evacuated_by_goal.sum()),
+        "evacuated_by_goal": evacuated_by_goal.tolist(),
+        "remaining": len(AGENTS),
+        "completed": done,
+        "stalled": not done and stalled,
+        "evacuation_time": tick if done else None,
+        # Agent-ticks: visits of the busiest cell over the run, ticks agents spent without moving
+        "max_cell_visits": int(density_map.max()),
+        "wait_ticks": stuck,
+        "elapsed": elapsed,
+        "ticks_per_second": (tick - first_tick) / elapsed if elapsed else 0.0,
+        "resumed_at": first_tick if checkpoint is not None else None,
+        "profile": profiler.summary()
+    }
 
 
 if __name__ == "__main__":
@@ -284,17 +873,48 @@ if __name__ == "__main__":
     parser.add_argument('-aa', '--AGENTS_AMOUNT', help='Maximum simulation agents amount', required=True)
     parser.add_argument('-psr', '--PASSENGERS_SPAWN_RECTS', help='Rectangle, where agents are being spawned',
                         required=True)
-    parser.add_argument('-g', '--goal', help='Target for all agents', required=True)
+    parser.add_argument('-g', '--goal', help='Target [x, y] for all agents, or a list of targets', required=True)
+    parser.add_argument('-sg', '--SPAWN_GOALS', help='Per spawn rect, goal id or weights over the targets',
+                        default='null')
+    parser.add_argument('-mfs', '--MAX_FIELDS', help='Per-goal fields or planners kept in memory', default='16')
+    parser.add_argument('-pl', '--PLANNER', help='Path planner: astar, jps, flow, adstar or hpa', default='astar')
+    parser.add_argument('-en', '--ENGINE', help='Agent engine: grid or social', default='grid')
+    parser.add_argument('-sch', '--SCHEDULE', help='Spawn, arrival rate and gate events: JSON list or file',
+                        default='null')
+    parser.add_argument('-hcs', '--HPA_CLUSTER_SIZE', help='Cluster size in cells for the hpa planner', default='10')
+    parser.add_argument('--headless', dest='HEADLESS', action='store_true', help='Run without a display')
+    parser.add_argument('-re', '--render-every', dest='RENDER_EVERY', help='Draw only every N-th tick', default='1')
+    parser.add_argument('-mt', '--MAX_TICKS', help='Stop after this many ticks', default='null')
+    parser.add_argument('-stl', '--STALL_TICKS', help='Stop after this many ticks without an arrival', default='1000')
+    parser.add_argument('-mtr', '--METRICS', help='npz file for per-tick timings and counters', default='null')
+    parser.add_argument('-sd', '--seed', dest='SEED', help='Seed of the run, fresh entropy by default', default='null')
+    parser.add_argument('-ce', '--CHECKPOINT_EVERY', help='Save a checkpoint every N ticks', default='null')
+    parser.add_argument('--resume', dest='RESUME', action='store_true', help='Continue from the last checkpoint')
+    parser.add_argument('--profile', dest='PROFILE', nargs='?', const='-', default=None,
+                        help='Run under cProfile; print the top functions, or dump the stats to the given file')
 
     args = vars(parser.parse_args())
     pn, sn = args['PROJECT_NAME'], args['SIM_NAME']
     res = {}
 
     for key in args.keys():
-        if key not in ('PROJECT_NAME', 'SIM_NAME'):
+        if key not in ('PROJECT_NAME', 'SIM_NAME', 'PROFILE'):
             try:
                 res[key] = json.loads(args[key])
             except:
                 res[key] = args[key]
-    run_simulation(args['PROJECT_NAME'], args['SIM_NAME'],
-                   **res)
+    if args['PROFILE'] is None:
+        stats = run_simulation(args['PROJECT_NAME'], args['SIM_NAME'],
+                               **res)
+    else:
+        profile = cProfile.Profile()
+        stats = profile.runcall(run_simulation, args['PROJECT_NAME'], args['SIM_NAME'], **res)
+        if args['PROFILE'] == '-':
+            pstats.Stats(profile, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+        else:
+            profile.dump_stats(args['PROFILE'])
+    tick_ms = stats['profile'].get('tick_ms')
+    if tick_ms:
+        print(f"tick latency, ms: p50 {tick_ms['p50']:.2f} p95 {tick_ms['p95']:.2f} p99 {tick_ms['p99']:.2f} "
+              f"max {tick_ms['max']:.2f}", file=sys.stderr)
+    print(json.dumps(stats))
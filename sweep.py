@@ -0,0 +1,120 @@
+"""
+Parameter sweeps: every combination of the grid values runs headless across a process pool.
+
+    python3 sweep.py -pn Восточный -c sweep.json -o results.csv
+
+sweep.json:
+    {"base": {"GRID_SIZE": [64, 87], "GRID_CELL_SIZE": 10, "goal": [10, 6], "PLANNER": "flow"},
+     "grid": {"MODEL_FILENAME": ["Frame 11.png", "Frame 11 - OPT.png"], "AGENTS_AMOUNT": [50, 100]},
+     "seeds": [0, 1, 2]}
+
+A scenario with seed n draws the same spawns as `simulation.py --seed n`, so layouts run with the same seeds
+see the same crowd. Without seeds every scenario gets its own substream [entropy, n] of one sweep seed.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from simulation import run_simulation
+from utilities import load_model
+
+MODEL_PARAMS = ('MODEL_FILENAME', 'GRID_SIZE', 'GRID_CELL_SIZE', 'SVG_SCALE', 'SVG_DELTA')
+MODEL_DEFAULTS = {'GRID_SIZE': (50, 50), 'GRID_CELL_SIZE': 10, 'SVG_SCALE': 1, 'SVG_DELTA': (0, 0)}
+STATS = ('ticks', 'evacuation_time', 'agents', 'unspawned', 'evacuated', 'remaining', 'max_cell_visits', 'wait_ticks',
+         'stalled', 'elapsed')
+
+_MODELS = {}
+
+
+def model_key(params):
+    return json.dumps([params.get(k, MODEL_DEFAULTS.get(k)) for k in MODEL_PARAMS])
+
+
+def scenarios(base, grid, seeds=(None,)):
+    """
+    :param seeds: run seeds; None is replaced by an independent substream of a fresh sweep seed
+    :return: run_simulation kwargs for every combination of the grid values and seeds
+    """
+    keys = list(grid)
+    entropy = np.random.SeedSequence().entropy
+    result = []
+    for values in itertools.product(*(grid[k] for k in keys)):
+        for seed in seeds:
+            params = dict(base)
+            params.update(zip(keys, values))
+            params['SEED'] = seed if seed is not None else [entropy, len(result)]
+            result.append(params)
+    return result
+
+
+def _init_worker(models):
+    global _MODELS
+    _MODELS = models
+
+
+def _run_scenario(project_name, params, sim_name=None):
+    # Sweeps always run headless on the shared models, whatever the config says
+    params = {k: v for k, v in params.items() if k not in ('HEADLESS', 'MODEL')}
+    return run_simulation(project_name, sim_name, HEADLESS=True, MODEL=_MODELS[model_key(params)], **params)
+
+
+def run_sweep(project_name, base, grid, seeds=(None,), workers=None, record=False):
+    """
+    Runs every scenario headless across all cores.
+    Each model is discretized once in this process and handed to every worker on start-up.
+    :param record: keep the trajectory of every run as Simulations/sweep-<n>.traj
+    :return: list of rows, scenario params merged with the run stats
+    """
+    runs = scenarios(base, grid, seeds)
+
+    models = {}
+    for params in runs:
+        key = model_key(params)
+        if key not in models:
+            model_filename, grid_size, cell_size, svg_scale, svg_delta = json.loads(key)
+            models[key] = load_model(project_name, model_filename, grid_size, cell_size,
+                                     svg_scale=svg_scale, svg_delta=svg_delta)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             initializer=_init_worker, initargs=(models,)) as pool:
+        futures = [pool.submit(_run_scenario, project_name, params, f'sweep-{n}.traj' if record else None)
+                   for n, params in enumerate(runs)]
+        rows = []
+        for params, future in zip(runs, futures):
+            row = dict(params)
+            row.update(future.result())
+            rows.append(row)
+    return rows
+
+
+def write_table(rows, grid, output=None):
+    columns = list(grid) + ['SEED'] + list(STATS)
+    f = open(output, mode='w', newline='') if output else sys.stdout
+    writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({k: json.dumps(v) if isinstance(v, (list, tuple)) else v for k, v in row.items()})
+    if output:
+        f.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='SkillUp parameter sweep')
+    parser.add_argument('-pn', '--PROJECT_NAME', help='Project name', required=True)
+    parser.add_argument('-c', '--CONFIG', help='Sweep config JSON: base, grid, seeds', required=True)
+    parser.add_argument('-o', '--OUTPUT', help='CSV results table, stdout by default')
+    parser.add_argument('-w', '--WORKERS', type=int, help='Worker processes, all cores by default')
+    parser.add_argument('--record', action='store_true', help='Keep the trajectory of every run')
+
+    args = vars(parser.parse_args())
+    config = json.load(open(args['CONFIG'], mode='r'))
+    grid = config.get('grid', {})
+    rows = run_sweep(args['PROJECT_NAME'], config.get('base', {}), grid,
+                     seeds=config.get('seeds', [None]), workers=args['WORKERS'], record=args['record'])
+    write_table(rows, grid, args['OUTPUT'])
@@ -0,0 +1,24 @@
+import numpy as np
+
+from planning.Star import ADStarPlanner
+
+
+def test_agent_on_goal_keeps_the_plan():
+    tile_map = np.zeros((10, 10), dtype=int)
+    tile_map[5, :8] = 1
+    goal = (2, 2)
+    planner = ADStarPlanner(tile_map, goal)
+
+    # An agent parked on the goal, another one heading there from behind the wall
+    occupied = np.zeros(tile_map.shape, dtype=bool)
+    occupied[goal] = True
+    occupied[8, 2] = True
+    planner.update(tile_map.astype(bool) | occupied)
+
+    assert planner.cost_of((8, 2), occupied) < float("inf")
+    assert planner.next_step((8, 2), occupied) != [8, 2]
+
+    # The goal comes back as the root once the agent leaves
+    occupied[goal] = False
+    planner.update(tile_map.astype(bool) | occupied)
+    assert planner.dstar.g_of(goal) == 0.0
@@ -0,0 +1,17 @@
+import numpy as np
+
+from simulation import distance_field, flow_step
+
+
+def test_sidestep_when_downhill_is_taken():
+    tile_map = np.zeros((10, 10), dtype=int)
+    field = distance_field(tile_map, (0, 5))
+
+    # Every cell closer to the goal is taken, the agent steps aside rather than waiting
+    tiles = tile_map.copy()
+    tiles[4, 4:7] = 1
+    assert flow_step(field, tiles, (5, 5)) in ([5, 4], [5, 6])
+
+    # Only the cell straight back is free: the agent waits
+    tiles[5, 4] = tiles[5, 6] = 1
+    assert flow_step(field, tiles, (5, 5)) == [5, 5]
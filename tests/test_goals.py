@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from simulation import parse_goals
+
+
+def test_parse_goals_rejects_bad_goals():
+    tile_map = np.zeros((10, 10), dtype=int)
+    tile_map[5, 5] = 1
+
+    assert parse_goals([[1, 1], [8, 8]], tile_map, [0, [0.3, 0.7]]).tolist() == [[1, 1], [8, 8]]
+    with pytest.raises(ValueError, match=r'\[10, 2\]'):
+        parse_goals([[1, 1], [10, 2]], tile_map)
+    with pytest.raises(ValueError, match=r'\[5, 5\]'):
+        parse_goals([5, 5], tile_map)
+    with pytest.raises(ValueError, match='goal 2'):
+        parse_goals([[1, 1], [8, 8]], tile_map, [2])
+    with pytest.raises(ValueError, match='3 goal weights'):
+        parse_goals([[1, 1], [8, 8]], tile_map, [[0.2, 0.3, 0.5]])
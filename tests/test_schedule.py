@@ -0,0 +1,17 @@
+import numpy as np
+
+from simulation import run_simulation
+
+
+def test_stall_with_a_spawn_left_waiting():
+    # The goal is walled off, the agents never leave the 2x2 spawn rect and the rest of the burst keeps waiting
+    tile_map = np.zeros((10, 10), dtype=int)
+    tile_map[5, :] = 1
+    stats = run_simulation('Box', None, goal=[8, 8], AGENTS_AMOUNT=10, PASSENGERS_SPAWN_RECTS=[[1, 1, 1, 1]],
+                           PLANNER='flow', HEADLESS=True, SEED=0, STALL_TICKS=20, MAX_TICKS=1000,
+                           MODEL=('svg', [], tile_map, [], tile_map.shape))
+
+    assert stats['stalled']
+    assert stats['ticks'] == 20
+    assert stats['remaining'] == 4
+    assert stats['unspawned'] == 6
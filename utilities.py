@@ -1,7 +1,12 @@
+import hashlib
+import json
 import math
+import os
 import random
+import re
+from array import array
 from typing import Tuple
-from xml.dom import minidom
+from xml.etree.ElementTree import iterparse
 from PIL import Image
 import numpy as np
 
@@ -45,10 +50,45 @@ def rect_collision(rect1, rect2):
 
 
 def generate_tile_map(rects, grid_size, cell_size=10) -> np.ndarray:
-    arr = np.array(
-        [[1 if intersects((x * cell_size, y * cell_size), rects) else 0 for y in range(grid_size[1])] for x in
-         range(grid_size[0])])
-    return arr
+    return rasterize_rects(rects, grid_size, cell_size)[0]
+
+
+def _cell_span(start, length, cell_size, collider_size, limit):
+    """
+    Cells whose collider box [c * cell_size - collider_size // 2, ... + collider_size)
+    overlaps [start, start + length); same strict inequalities as rect_collision.
+    Works on scalars and on arrays of rects.
+    """
+    half = collider_size // 2
+    first = (start - collider_size + half) // cell_size + 1
+    last = -(-(start + length + half) // cell_size)
+    return np.maximum(first, 0), np.minimum(last, limit)
+
+
+def rasterize_boxes(boxes, grid_size, cell_size=10, collider_size=10):
+    """
+    Burns (N, 4) x, y, w, h boxes into a boolean grid, dilated by the collider size.
+    Equivalent to calling intersects() for every cell, in O(W*H + N).
+    :return: tile map (1 - obstacle) and the list of obstacle cells
+    """
+    blocked = np.zeros((int(grid_size[0]), int(grid_size[1])), dtype=bool)
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    x0, x1 = _cell_span(boxes[:, 0], boxes[:, 2], cell_size, collider_size, blocked.shape[0])
+    y0, y1 = _cell_span(boxes[:, 1], boxes[:, 3], cell_size, collider_size, blocked.shape[1])
+    for n in np.flatnonzero((x0 < x1) & (y0 < y1)):
+        blocked[x0[n]:x1[n], y0[n]:y1[n]] = True
+    return blocked.astype(int), obstacle_cells(blocked)
+
+
+def rasterize_rects(rects, grid_size, cell_size=10, collider_size=10):
+    """
+    rasterize_boxes for a list of ((x, y), (w, h), color) rects.
+    """
+    return rasterize_boxes([(*xy, *wh) for xy, wh, *_ in rects], grid_size, cell_size, collider_size)
+
+
+def obstacle_cells(tile_map) -> list:
+    return [(int(x), int(y)) for x, y in np.argwhere(tile_map)]
 
 
 def intersects(point, colliders, collider_size=10):
@@ -61,40 +101,498 @@ def intersects(point, colliders, collider_size=10):
     return s
 
 
-def discrete_png(path_to_file, grid_size, image_delta=(0, 0), image_scale=1):
+def _block_starts(pixels, cells):
+    """
+    First pixel of every cell along one axis and the number of pixels it covers.
+    Downsampling splits the pixels into near-equal blocks; upsampling picks the nearest pixel.
+    """
+    if pixels >= cells:
+        starts = np.arange(cells) * pixels // cells
+    else:
+        starts = ((np.arange(cells) + 0.5) * pixels / cells).astype(np.int64)
+    counts = np.maximum(np.diff(np.append(starts, pixels)), 1)
+    return starts, counts
+
+
+def discrete_png(path_to_file, grid_size, image_delta=(0, 0), image_scale=1, threshold=10, occupancy='any',
+                 tile_rows=1024):
+    """
+    Discretizes a plan image: pixels brighter than threshold are walls.
+    The image is scaled to GRID_SIZE * image_scale cells by block reduction and placed image_delta cells
+    from the corner of the grid; cells outside the image are free.
+    The image is reduced in strips of whole cell rows, about tile_rows pixels high,
+    so only one strip is converted at a time.
+    :param occupancy: 'any' - a cell is a wall if any of its pixels is, 'majority' - if at least half of them are,
+    or the fraction of wall pixels as a float
+    :return: tile map indexed [x][y], 1 - obstacle
+    """
+    fraction = {'any': 1e-9, 'majority': 0.5}.get(occupancy, occupancy)
     img = Image.open(path_to_file)
-    img.resize((int(grid_size[0] * image_scale), int(grid_size[1] * image_scale)), Image.ANTIALIAS)
-    thresh = 10
-    fn = lambda x: 255 if x > thresh else 0
-    r = img.convert('L').point(fn, mode='1')
-    return np.asarray(r).transpose()
+    width, height = img.size
+    cells_x = max(int(round(grid_size[0] * image_scale)), 1)
+    cells_y = max(int(round(grid_size[1] * image_scale)), 1)
+    starts_x, counts_x = _block_starts(width, cells_x)
+    starts_y, counts_y = _block_starts(height, cells_y)
 
+    walls = np.zeros((cells_y, cells_x), dtype=bool)
+    rows_per_strip = max(int(tile_rows * cells_y // height), 1)
+    for j0 in range(0, cells_y, rows_per_strip):
+        j1 = min(j0 + rows_per_strip, cells_y)
+        y0, y1 = starts_y[j0], starts_y[j1 - 1] + counts_y[j1 - 1]
+        strip = np.asarray(img.crop((0, int(y0), width, int(y1))).convert('L')) > threshold
+        sums = np.add.reduceat(np.add.reduceat(strip.astype(np.int64), starts_y[j0:j1] - y0, axis=0),
+                               starts_x, axis=1)
+        walls[j0:j1] = sums >= fraction * np.outer(counts_y[j0:j1], counts_x)
 
-def get_rects(path_to_file, svg_delta=(0, 0), svg_scale=1):
-    # Load all colliders
-    doc = minidom.parse(open(path_to_file))
-    rects = [
-        (
-            rect.getAttribute('x') if rect.getAttribute('x') != '' else '0',
-            rect.getAttribute('y') if rect.getAttribute('y') != '' else '0',
-            rect.getAttribute('width'),
-            rect.getAttribute('height'),
-            rect.getAttribute('fill'))
-        for rect in doc.getElementsByTagName('rect')]
-
-    rects = map(lambda x: (
-        (int(x[0]) + svg_delta[0], int(x[1]) + svg_delta[1]),
-        (int(x[2]), int(x[3])),
-        x[4]),
-                rects)
-
-    rects = map(lambda x: (*x[:2], cv_col(x[2].strip('#'))), rects)
-    rects = list(
-        map(
-            lambda x: (tuple(int(k * svg_scale) for k in x[0]), tuple(int(k * svg_scale) for k in x[1]), x[2]),
-            rects
-        )
-    )
-    return rects
+    tile_map = np.zeros((int(grid_size[0]), int(grid_size[1])), dtype=int)
+    dx, dy = int(image_delta[0]), int(image_delta[1])
+    x0, y0 = max(dx, 0), max(dy, 0)
+    x1, y1 = min(dx + cells_x, tile_map.shape[0]), min(dy + cells_y, tile_map.shape[1])
+    if x0 < x1 and y0 < y1:
+        tile_map[x0:x1, y0:y1] = walls.T[x0 - dx:x1 - dx, y0 - dy:y1 - dy]
+    return tile_map
+
+
+MODEL_CACHE_VERSION = 3
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
 
 
+def discretize_model(path, grid_size, cell_size, svg_scale=1, svg_delta=(0, 0)):
+    """
+    Parses and discretizes a model file.
+    :return: draw type ('svg' or 'png'), rects (svg only), tile map, obstacle cells and the actual grid size
+    """
+    if path.endswith('.svg'):
+        boxes, colors = parse_svg_colliders(path, svg_delta=svg_delta, svg_scale=svg_scale)
+        tile_map, obstacles = rasterize_boxes(boxes, grid_size, cell_size)
+        return 'svg', boxes_to_rects(boxes, colors), tile_map, obstacles, grid_size
+
+    tile_map = discrete_png(path, grid_size, image_delta=svg_delta, image_scale=svg_scale)
+    return 'png', [], tile_map, obstacle_cells(tile_map), grid_size
+
+
+def model_cache_path(project_name, model_filename, params):
+    digest = hashlib.sha1(json.dumps(params).encode()).hexdigest()[:12]
+    return f"Projects/{project_name}/Cache/{model_filename}.{digest}.npz"
+
+
+def _save_model(cache_file, key, model):
+    draw_type, rects, tile_map, obstacles, grid_size = model
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = cache_file + '.tmp.npz'
+    np.savez_compressed(tmp_file, key=key, draw_type=draw_type,
+                        rect_boxes=np.array([(*xy, *wh) for xy, wh, _ in rects], dtype=np.int64).reshape(-1, 4),
+                        rect_colors=np.array([color for *_, color in rects], dtype=np.uint8).reshape(-1, 3),
+                        tile_map=tile_map,
+                        obstacles=np.array(obstacles, dtype=np.int64).reshape(-1, 2),
+                        grid_size=np.array(grid_size, dtype=np.int64))
+    os.replace(tmp_file, cache_file)
+
+
+def _load_model(cache_file, key):
+    """
+    :return: cached load_model result, None if missing or stale
+    """
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with np.load(cache_file) as cached:
+            if str(cached['key']) != key:
+                return None
+            rects = [((x, y), (w, h), tuple(color))
+                     for (x, y, w, h), color in zip(cached['rect_boxes'].tolist(), cached['rect_colors'].tolist())]
+            obstacles = [tuple(cell) for cell in cached['obstacles'].tolist()]
+            return (str(cached['draw_type']), rects, cached['tile_map'], obstacles,
+                    tuple(cached['grid_size'].tolist()))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_model(project_name, model_filename, grid_size, cell_size, svg_scale=1, svg_delta=(0, 0), cache=True):
+    """
+    Discretized project model, cached in Projects/<project>/Cache/ by the model file hash
+    and the discretization parameters.
+    :param cache: read and write the cache; False always parses the model again
+    :return: draw type ('svg' or 'png'), rects (svg only), tile map, obstacle cells and the actual grid size
+    """
+    path = f"Projects/{project_name}/Models/{model_filename}"
+    if not cache:
+        return discretize_model(path, grid_size, cell_size, svg_scale=svg_scale, svg_delta=svg_delta)
+
+    params = [MODEL_CACHE_VERSION, model_filename, list(grid_size), cell_size, svg_scale, list(svg_delta)]
+    cache_file = model_cache_path(project_name, model_filename, params)
+    key = f'{file_hash(path)}:{json.dumps(params)}'
+
+    model = _load_model(cache_file, key)
+    if model is None:
+        model = discretize_model(path, grid_size, cell_size, svg_scale=svg_scale, svg_delta=svg_delta)
+        _save_model(cache_file, key, model)
+    return model
+
+
+SVG_COLLIDERS = ('rect', 'polygon', 'polyline', 'path', 'line')
+# Size in pixels of the boxes slanted strokes and fills are cut into
+SVG_RASTER_STEP = 4
+# Segments a bezier curve is flattened into, and per half turn of an arc
+SVG_CURVE_SEGMENTS = 8
+# Containers whose content is never drawn by itself
+SVG_SKIPPED = ('defs', 'clipPath', 'mask', 'symbol', 'pattern', 'marker')
+
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+_NUMBER = re.compile(r'[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?')
+_TRANSFORM = re.compile(r'(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)')
+_PATH_TOKEN = re.compile(r'[MmLlHhVvCcSsQqTtAaZz]|[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?')
+_PATH_ARGS = {'M': 2, 'L': 2, 'T': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'A': 7, 'Z': 0}
+
+
+def _svg_number(value, default=0.0):
+    match = _NUMBER.match(value.strip()) if value else None
+    return float(match.group()) if match else default
+
+
+def _svg_color(value):
+    """
+    :return: (r, g, b) of a '#rrggbb' or '#rgb' fill, None for anything else (none, url(...), names)
+    """
+    value = (value or '').strip().lstrip('#')
+    if len(value) == 3:
+        value = ''.join(c * 2 for c in value)
+    try:
+        return cv_col(value) if len(value) == 6 else None
+    except ValueError:
+        return None
+
+
+def _compose(m, n):
+    """
+    Affine matrix m * n, both (a, b, c, d, e, f) as in the SVG transform attribute.
+    """
+    a, b, c, d, e, f = m
+    a2, b2, c2, d2, e2, f2 = n
+    return (a * a2 + c * b2, b * a2 + d * b2, a * c2 + c * d2, b * c2 + d * d2,
+            a * e2 + c * f2 + e, b * e2 + d * f2 + f)
+
+
+def parse_transform(value):
+    m = IDENTITY
+    for name, args in _TRANSFORM.findall(value or ''):
+        v = [float(k) for k in _NUMBER.findall(args)]
+        if name == 'matrix' and len(v) == 6:
+            n = tuple(v)
+        elif name == 'translate' and v:
+            n = (1.0, 0.0, 0.0, 1.0, v[0], v[1] if len(v) > 1 else 0.0)
+        elif name == 'scale' and v:
+            n = (v[0], 0.0, 0.0, v[1] if len(v) > 1 else v[0], 0.0, 0.0)
+        elif name == 'rotate' and v:
+            cos, sin = math.cos(math.radians(v[0])), math.sin(math.radians(v[0]))
+            n = (cos, sin, -sin, cos, 0.0, 0.0)
+            if len(v) == 3:
+                n = _compose(_compose((1.0, 0.0, 0.0, 1.0, v[1], v[2]), n), (1.0, 0.0, 0.0, 1.0, -v[1], -v[2]))
+        elif name == 'skewX' and v:
+            n = (1.0, 0.0, math.tan(math.radians(v[0])), 1.0, 0.0, 0.0)
+        elif name == 'skewY' and v:
+            n = (1.0, math.tan(math.radians(v[0])), 0.0, 1.0, 0.0, 0.0)
+        else:
+            continue
+        m = _compose(m, n)
+    return m
+
+
+def _svg_paint(value, inherited):
+    """
+    :return: (r, g, b) of a fill or stroke, None for 'none'; unset paint is inherited,
+    paints without a colour of their own (url(...), names) keep the inherited one
+    """
+    value = (value or '').strip()
+    if not value or value == 'inherit':
+        return inherited
+    if value == 'none':
+        return None
+    return _svg_color(value) or inherited or (0, 0, 0)
+
+
+def _cubic_points(p0, p1, p2, p3):
+    points = []
+    for k in range(1, SVG_CURVE_SEGMENTS + 1):
+        t = k / SVG_CURVE_SEGMENTS
+        u = 1 - t
+        points.append(tuple(u ** 3 * a + 3 * u * u * t * b + 3 * u * t * t * c + t ** 3 * d
+                            for a, b, c, d in zip(p0, p1, p2, p3)))
+    return points
+
+
+def _quadratic_points(p0, p1, p2):
+    points = []
+    for k in range(1, SVG_CURVE_SEGMENTS + 1):
+        t = k / SVG_CURVE_SEGMENTS
+        u = 1 - t
+        points.append(tuple(u * u * a + 2 * u * t * b + t * t * c for a, b, c in zip(p0, p1, p2)))
+    return points
+
+
+def _arc_points(p0, rx, ry, angle, large, sweep, p1):
+    """
+    Elliptical arc from p0 to p1 in the endpoint parametrization of the SVG spec (F.6.5), flattened.
+    """
+    rx, ry = abs(rx), abs(ry)
+    if not rx or not ry or p0 == p1:
+        return [p1]
+    cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    dx, dy = (p0[0] - p1[0]) / 2, (p0[1] - p1[1]) / 2
+    x1, y1 = cos * dx + sin * dy, -sin * dx + cos * dy
+    scale = x1 * x1 / (rx * rx) + y1 * y1 / (ry * ry)
+    if scale > 1:
+        rx, ry = rx * math.sqrt(scale), ry * math.sqrt(scale)
+    num = rx * rx * ry * ry - rx * rx * y1 * y1 - ry * ry * x1 * x1
+    k = math.sqrt(max(num, 0.0) / (rx * rx * y1 * y1 + ry * ry * x1 * x1))
+    if bool(large) == bool(sweep):
+        k = -k
+    cx1, cy1 = k * rx * y1 / ry, -k * ry * x1 / rx
+    cx = cos * cx1 - sin * cy1 + (p0[0] + p1[0]) / 2
+    cy = sin * cx1 + cos * cy1 + (p0[1] + p1[1]) / 2
+    t0 = math.atan2((y1 - cy1) / ry, (x1 - cx1) / rx)
+    dt = math.atan2((-y1 - cy1) / ry, (-x1 - cx1) / rx) - t0
+    if sweep and dt < 0:
+        dt += 2 * math.pi
+    elif not sweep and dt > 0:
+        dt -= 2 * math.pi
+    n = max(int(math.ceil(abs(dt) / (math.pi / SVG_CURVE_SEGMENTS))), 1)
+    points = []
+    for j in range(1, n):
+        t = t0 + dt * j / n
+        x, y = rx * math.cos(t), ry * math.sin(t)
+        points.append((cos * x - sin * y + cx, sin * x + cos * y + cy))
+    return points + [p1]
+
+
+def _path_subpaths(d):
+    """
+    Subpaths of a path as polylines, curves and arcs flattened.
+    :return: list of (points, closed)
+    """
+    subpaths = []
+    points = []
+    cur = start = (0.0, 0.0)
+    # Last control point and the kind of curve ('C' or 'Q') it belongs to, reflected by S and T
+    control, kind = None, None
+    command = None
+    tokens = _PATH_TOKEN.findall(d or '')
+    i = 0
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+            if command in 'Zz':
+                if points:
+                    subpaths.append((points, True))
+                    points = []
+                cur, kind = start, None
+                continue
+        if command is None:
+            break
+        upper = command.upper()
+        n = _PATH_ARGS[upper]
+        args = [float(k) for k in tokens[i:i + n]]
+        if len(args) < n or any(t.isalpha() for t in tokens[i:i + n]):
+            break
+        i += n
+        rx, ry = cur if command.islower() else (0.0, 0.0)
+        if upper == 'M':
+            if len(points) > 1:
+                subpaths.append((points, False))
+            cur = start = (args[0] + rx, args[1] + ry)
+            points, kind = [cur], None
+            # Coordinates after a moveto are implicit linetos
+            command = 'l' if command == 'm' else 'L'
+            continue
+        if not points:
+            points = [cur]
+        xy = [(args[k] + rx, args[k + 1] + ry) for k in range(0, n - 1, 2)]
+        if upper in 'ST':
+            smooth = 'C' if upper == 'S' else 'Q'
+            xy.insert(0, (2 * cur[0] - control[0], 2 * cur[1] - control[1]) if kind == smooth else cur)
+        if upper == 'H':
+            segment, kind = [(args[0] + rx, cur[1])], None
+        elif upper == 'V':
+            segment, kind = [(cur[0], args[0] + ry)], None
+        elif upper == 'L':
+            segment, kind = xy, None
+        elif upper in 'CS':
+            segment, control, kind = _cubic_points(cur, *xy), xy[1], 'C'
+        elif upper in 'QT':
+            segment, control, kind = _quadratic_points(cur, *xy), xy[0], 'Q'
+        else:
+            segment, kind = _arc_points(cur, args[0], args[1], args[2], args[3], args[4],
+                                        (args[5] + rx, args[6] + ry)), None
+        points += segment
+        cur = segment[-1]
+    if len(points) > 1:
+        subpaths.append((points, False))
+    return subpaths
+
+
+def _shape_subpaths(tag, elem):
+    """
+    :return: outline of a collider element as list of (points, closed), in its own coordinates
+    """
+    get = elem.get
+    if tag == 'rect':
+        x, y = _svg_number(get('x')), _svg_number(get('y'))
+        w, h = _svg_number(get('width')), _svg_number(get('height'))
+        return [([(x, y), (x + w, y), (x + w, y + h), (x, y + h)], True)]
+    if tag == 'line':
+        return [([(_svg_number(get('x1')), _svg_number(get('y1'))),
+                  (_svg_number(get('x2')), _svg_number(get('y2')))], False)]
+    if tag in ('polygon', 'polyline'):
+        v = [float(k) for k in _NUMBER.findall(get('points') or '')]
+        points = list(zip(v[0::2], v[1::2]))
+        return [(points, tag == 'polygon')] if points else []
+    return _path_subpaths(get('d'))
+
+
+def _stroke_boxes(points, closed, half_width, step):
+    """
+    Boxes covering a polyline stroked half_width to each side: a horizontal or vertical segment is one box,
+    a slanted one is cut into pieces at most step long along its major axis.
+    :return: (K, 4) x, y, w, h
+    """
+    p = np.asarray(points + points[:1] if closed else points, dtype=np.float64)
+    a, b = p[:-1], p[1:]
+    n = np.ceil(np.abs(b - a).max(axis=1) / step).astype(np.int64)
+    n[(a[:, 0] == b[:, 0]) | (a[:, 1] == b[:, 1]) | (n < 1)] = 1
+    segment = np.repeat(np.arange(len(a)), n)
+    k = (np.arange(len(segment)) - np.repeat(np.cumsum(n) - n, n))[:, None]
+    delta = (b - a)[segment] / n[segment, None]
+    p0 = a[segment] + delta * k
+    p1 = p0 + delta
+    lo = np.minimum(p0, p1) - half_width
+    return np.hstack([lo, np.maximum(p0, p1) + half_width - lo])
+
+
+def _fill_boxes(subpaths, nonzero, step):
+    """
+    Scanline fill of the subpaths, each one closed: every band step high gets a box per span inside the shape
+    at the middle of the band. The outline is not covered, stroke it to include the edges.
+    :param nonzero: fill-rule nonzero, evenodd otherwise
+    :return: (K, 4) x, y, w, h
+    """
+    edges = [np.asarray(points + points[:1], dtype=np.float64) for points, _ in subpaths]
+    a = np.concatenate([p[:-1] for p in edges])
+    b = np.concatenate([p[1:] for p in edges])
+    slanted = a[:, 1] != b[:, 1]
+    a, b = a[slanted], b[slanted]
+    if not len(a):
+        return np.zeros((0, 4))
+    boxes = []
+    top, bottom = min(a[:, 1].min(), b[:, 1].min()), max(a[:, 1].max(), b[:, 1].max())
+    low, high = np.minimum(a[:, 1], b[:, 1]), np.maximum(a[:, 1], b[:, 1])
+    for y in np.arange(math.floor(top / step) * step, bottom, step):
+        middle = y + step / 2
+        crossing = (low <= middle) & (middle < high)
+        if not crossing.any():
+            continue
+        ca, cb = a[crossing], b[crossing]
+        xs = ca[:, 0] + (middle - ca[:, 1]) * (cb[:, 0] - ca[:, 0]) / (cb[:, 1] - ca[:, 1])
+        order = np.argsort(xs)
+        xs = xs[order]
+        if nonzero:
+            inside = np.cumsum(np.sign(cb[:, 1] - ca[:, 1])[order]) != 0
+        else:
+            inside = np.arange(1, len(xs) + 1) % 2 == 1
+        y0, y1 = max(y, top), min(y + step, bottom)
+        for n in np.flatnonzero(inside[:-1]):
+            boxes.append((xs[n], y0, xs[n + 1] - xs[n], y1 - y0))
+    return np.array(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def _extend_boxes(boxes, colors, shape, color):
+    boxes.frombytes(np.ascontiguousarray(shape, dtype=np.float64).tobytes())
+    colors.frombytes(np.tile(np.array(color, dtype=np.uint8), len(shape)).tobytes())
+
+
+def parse_svg_colliders(path_to_file, svg_delta=(0, 0), svg_scale=1):
+    """
+    Streams the colliders of an SVG with iterparse: rects, polygons, polylines, lines and paths, with the
+    transforms of their groups applied. Fills and strokes are burnt in as they are painted: a filled rect
+    is one box, other shapes and strokes are cut into boxes about SVG_RASTER_STEP pixels wide; shapes painted
+    with neither are skipped. Finished elements are dropped right away, so memory depends on the depth of the
+    document and not on its size.
+    :return: (N, 4) int64 boxes x, y, w, h shifted by svg_delta and scaled by svg_scale, (N, 3) uint8 colours
+    """
+    boxes = array('d')
+    colors = array('B')
+    step = SVG_RASTER_STEP / svg_scale
+    # (element, transform, (fill, stroke, stroke width, nonzero fill-rule)) of every open element
+    stack = [(None, IDENTITY, ((0, 0, 0), None, 1.0, True))]
+    skipped = 0
+
+    for event, elem in iterparse(path_to_file, events=('start', 'end')):
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if event == 'start':
+            _, matrix, (fill, stroke, width, nonzero) = stack[-1]
+            style = dict(item.split(':', 1) for item in (elem.get('style') or '').split(';') if ':' in item)
+            style = {key.strip(): value for key, value in style.items()}
+            attrs = {name: style.get(name, elem.get(name)) for name in ('fill', 'stroke', 'stroke-width', 'fill-rule')}
+            paint = (_svg_paint(attrs['fill'], fill), _svg_paint(attrs['stroke'], stroke),
+                     _svg_number(attrs['stroke-width'], width),
+                     nonzero if attrs['fill-rule'] is None else attrs['fill-rule'].strip() != 'evenodd')
+            stack.append((elem, _compose(matrix, parse_transform(elem.get('transform'))), paint))
+            skipped += tag in SVG_SKIPPED
+            continue
+
+        _, matrix, (fill, stroke, width, nonzero) = stack.pop()
+        if tag in SVG_SKIPPED:
+            skipped -= 1
+        elif tag in SVG_COLLIDERS and not skipped:
+            a, b, c, d, e, f = matrix
+            if tag == 'rect' and b == c == 0 and fill is not None:
+                # Axis-aligned filled rect, the usual collider: no outline needed
+                get = elem.get
+                x, y = a * _svg_number(get('x')) + e, d * _svg_number(get('y')) + f
+                w, h = a * _svg_number(get('width')), d * _svg_number(get('height'))
+                boxes.extend((min(x, x + w), min(y, y + h), abs(w), abs(h)))
+                colors.extend(fill)
+                fill = None
+            if tag == 'line':
+                fill = None
+            if stroke is not None and width <= 0:
+                stroke = None
+            subpaths = [([(a * x + c * y + e, b * x + d * y + f) for x, y in points], closed)
+                        for points, closed in _shape_subpaths(tag, elem)] if fill is not None or stroke is not None else []
+            if subpaths and fill is not None:
+                # The edges of the fill are stroked half a pixel wide, so thin parts between bands are kept
+                shape = [_fill_boxes(subpaths, nonzero, step)]
+                shape += [_stroke_boxes(points, True, step / SVG_RASTER_STEP / 2, step) for points, _ in subpaths]
+                _extend_boxes(boxes, colors, np.concatenate(shape), fill)
+            if subpaths and stroke is not None:
+                half_width = width * math.sqrt(abs(a * d - b * c)) / 2
+                shape = [_stroke_boxes(points, closed, half_width, step) for points, closed in subpaths]
+                _extend_boxes(boxes, colors, np.concatenate(shape), stroke)
+        # Every earlier sibling has already ended, so the parent only holds finished elements
+        parent = stack[-1][0]
+        if parent is not None:
+            del parent[:]
+
+    boxes = np.frombuffer(boxes, dtype=np.float64).reshape(-1, 4).copy()
+    boxes[:, :2] += svg_delta
+    boxes = np.trunc(boxes * svg_scale).astype(np.int64)
+    return boxes, np.frombuffer(colors, dtype=np.uint8).reshape(-1, 3).copy()
+
+
+def boxes_to_rects(boxes, colors) -> list:
+    """
+    :return: ((x, y), (w, h), (r, g, b)) tuples as drawn by the renderer
+    """
+    return [((x, y), (w, h), tuple(color)) for (x, y, w, h), color in zip(boxes.tolist(), colors.tolist())]
+
+
+def get_rects(path_to_file, svg_delta=(0, 0), svg_scale=1):
+    # Load all colliders
+    return boxes_to_rects(*parse_svg_colliders(path_to_file, svg_delta=svg_delta, svg_scale=svg_scale))
@@ -1,8 +1,4 @@
 import argparse
-import itertools
-import json
-import sys
-from xml.dom import minidom
 
 import numpy
 import pygame.gfxdraw
@@ -10,10 +6,10 @@ import pygame.gfxdraw
 import numpy as np
 import pygame
 
-from colour import Color
-
-from utilities import get_rects, intersects, generate_tile_map
-from utilities import cv_col, arrow, discrete_png
+from analysis import frame_ids, load_heatmaps
+from os_activities import open_trajectory
+from rendering import LayerCache, DirtyRenderer, color_lut, heatmap_surface, static_scene, draw_agents
+from utilities import load_model
 
 
 def load_next_positions(d=1):
@@ -29,9 +25,11 @@ def load_next_positions(d=1):
 def run_visualization(project_name, simulation_name):
     global FRAME_N, paths, calculated
 
-    simulation_data = json.load(open(f"Projects/{project_name}/Simulations/{simulation_name}", mode='r'))
-    meta, paths = simulation_data['meta'], simulation_data['paths']
-    PASSENGERS = simulation_data['paths'][0]
+    simulation_filename = f"Projects/{project_name}/Simulations/{simulation_name}"
+    meta, paths = open_trajectory(simulation_filename)
+    PASSENGERS = paths[0]
+    # Agents are matched between frames by id; JSON logs have none, there the index in the frame is used
+    has_ids = frame_ids(paths, 0) is not None
 
     SCREEN_SIZE = meta['SCREEN_SIZE']
     GRID_SIZE = meta['GRID_SIZE']
@@ -42,40 +40,14 @@ def run_visualization(project_name, simulation_name):
     FONT_NAME = meta['FONT_NAME']
     FRAME_N = 0
 
-    if MODEL_FILENAME.endswith('.svg'):
-        DRAW_TYPE = 'svg'
-        rects = get_rects(
-            f"Projects/{project_name}/Models/{MODEL_FILENAME}",
-            svg_delta=SVG_DELTA,
-            svg_scale=SVG_SCALE
-        )
-
-        TILE_MAP = generate_tile_map(rects, GRID_SIZE, GRID_CELL_SIZE)
-        obstacles = tuple(
-            tuple((x, y) if intersects(
-                (x * GRID_CELL_SIZE, y * GRID_CELL_SIZE), rects) else None for y in range(len(TILE_MAP[0]))) for x in
-            range(len(TILE_MAP)))
-    else:
-        DRAW_TYPE = 'png'
-        # background_img = pygame.image.load(f"Projects/{project_name}/Models/bg-{MODEL_FILENAME}").convert_alpha()
-
-        TILE_MAP = discrete_png(
-            f"Projects/{project_name}/Models/{MODEL_FILENAME}",
-            GRID_SIZE,
-            image_delta=SVG_DELTA,
-            image_scale=SVG_SCALE
-        )
-        obstacles = tuple(
-            tuple((i, j) if TILE_MAP[i][j] else None for j in range(len(TILE_MAP[0]))) for i in
-            range(len(TILE_MAP)))
-        GRID_SIZE = TILE_MAP.shape
-
-    DENSITY_MAP = np.zeros(GRID_SIZE)
-    STUCK_MAP = np.zeros(GRID_SIZE)
-
-    colors = list(Color("yellow").range_to(Color("red"), 255))
-
-    obstacles = list(filter(lambda x: x is not None, itertools.chain(*obstacles)))
+    DRAW_TYPE, rects, TILE_MAP, obstacles, GRID_SIZE = load_model(
+        project_name, MODEL_FILENAME, GRID_SIZE, GRID_CELL_SIZE, svg_scale=SVG_SCALE, svg_delta=SVG_DELTA)
+
+    # Heatmaps are baked for the whole trajectory up front instead of during the first playback
+    DENSITY_MAP, STUCK_MAP, STUCK_VECTORS = load_heatmaps(simulation_filename, paths, GRID_SIZE)
+
+    colors = color_lut("yellow", "red", 255)
+
     pygame.init()
     font = pygame.font.SysFont(FONT_NAME, 20)
     screen = pygame.display.set_mode(SCREEN_SIZE)
@@ -101,14 +73,32 @@ def run_visualization(project_name, simulation_name):
         'stuck_map': pygame.K_s,
         'reset_maps': pygame.K_f
     }
-    calculated = {'density_map': False,
-                  'stuck_map': False}
-
-    PREVIOUS_PASSENGERS = PASSENGERS[::-1]
-    max_stuck_value = 0
-    max_destiny_value = 0
-
-    STUCK_VECTORS = set()
+    calculated = {'density_map': True,
+                  'stuck_map': True}
+
+    PREVIOUS_PASSENGERS = {}
+    max_stuck_value = numpy.amax(STUCK_MAP)
+    max_destiny_value = numpy.amax(DENSITY_MAP)
+
+    # Map, colliders, tile grid and heatmaps are composited into one background,
+    # rebuilt only when a toggle or the maps change; agents and text are redrawn over it as dirty rects
+    layers = LayerCache()
+    renderer = DirtyRenderer(screen)
+    maps_version = 0
+
+    def build_background(static_key):
+        surface = layers.get('static', static_key,
+                             lambda: static_scene(SCREEN_SIZE, DRAW_TYPE, rects, TILE_MAP, GRID_CELL_SIZE, settings,
+                                                  collider_color=(93, 45, 92), tile_color=(240, 240, 240))).copy()
+        if settings['density_map']:
+            surface.blit(heatmap_surface(DENSITY_MAP, max_destiny_value, colors, GRID_CELL_SIZE,
+                                         outline=settings['stuck_map']), (0, 0))
+        if settings['stuck_map']:
+            surface.blit(heatmap_surface(STUCK_MAP, max_stuck_value, colors, GRID_CELL_SIZE), (0, 0))
+        pygame.gfxdraw.rectangle(surface,
+                                 ((0, 0), (GRID_SIZE[0] * GRID_CELL_SIZE, GRID_SIZE[1] * GRID_CELL_SIZE)),
+                                 (0, 255, 255))
+        return surface
 
     while running:
 
@@ -136,80 +126,38 @@ def run_visualization(project_name, simulation_name):
             STUCK_MAP = np.zeros(GRID_SIZE)
             for key in calculated:
                 calculated[key] = False
+            maps_version += 1
             FRAME_N = 0
             settings['reset_maps'] = False
 
-        # Make white screen background
-        screen.fill((255, 255, 255))
-
-        # Draw map
-        if DRAW_TYPE == 'svg':
-            if settings['show_map']:
-                for rect in rects:
-                    pygame.draw.rect(screen, rect[-1], (rect[0], rect[1]))
-
-        # Draw colliders
-        if settings['show_colliders']:
-            for c in obstacles:
-                x, y = c
-                rect = ((x * GRID_CELL_SIZE, y * GRID_CELL_SIZE),
-                        (GRID_CELL_SIZE, GRID_CELL_SIZE))
-                pygame.draw.rect(screen, (93, 45, 92), rect, 1)
-
-        if settings['show_tile_map']:
-            for i in range(len(TILE_MAP)):
-                for j in range(len(TILE_MAP[0])):
-                    if TILE_MAP[i][j] == 0:
-                        rect = ((i * GRID_CELL_SIZE, j * GRID_CELL_SIZE),
-                                (GRID_CELL_SIZE, GRID_CELL_SIZE))
-                        pygame.draw.rect(screen, (240, 240, 240), rect, 1)
-
         if not calculated['density_map']:
             for passenger in PASSENGERS:
                 DENSITY_MAP[passenger[0]][passenger[1]] += 1
             max_destiny_value = numpy.amax(DENSITY_MAP)
+            maps_version += 1
 
+        ids = frame_ids(paths, FRAME_N) if has_ids else range(len(PASSENGERS))
         if not calculated['stuck_map']:
             if settings['auto_animation']:
-                for i, passenger in enumerate(PASSENGERS):
-                    if i < len(PREVIOUS_PASSENGERS) and passenger == PREVIOUS_PASSENGERS[i]:
+                for agent_id, passenger in zip(ids, PASSENGERS):
+                    if PREVIOUS_PASSENGERS.get(agent_id) == passenger:
                         STUCK_MAP[passenger[0]][passenger[1]] += 1
                 max_stuck_value = numpy.amax(STUCK_MAP)
+                maps_version += 1
         else:
             if settings['auto_animation']:
-                if len(PASSENGERS) == len(PREVIOUS_PASSENGERS):
-                    for i, passenger in enumerate(PASSENGERS):
-                        prev = PREVIOUS_PASSENGERS[i]
-                        if STUCK_MAP[passenger[0]][passenger[1]] >= max_stuck_value / 2:
+                if has_ids or len(PASSENGERS) == len(PREVIOUS_PASSENGERS):
+                    for agent_id, passenger in zip(ids, PASSENGERS):
+                        prev = PREVIOUS_PASSENGERS.get(agent_id)
+                        if prev is not None and STUCK_MAP[passenger[0]][passenger[1]] >= max_stuck_value / 2:
                             STUCK_VECTORS.add((tuple(prev), tuple(passenger)))
 
-        PREVIOUS_PASSENGERS = PASSENGERS[:]
-
-        if settings['density_map']:
-            for i in range(DENSITY_MAP.shape[0]):
-                for j in range(DENSITY_MAP.shape[1]):
-                    v = DENSITY_MAP[i][j] / max_destiny_value
-                    rect = ((i * GRID_CELL_SIZE, j * GRID_CELL_SIZE),
-                            (GRID_CELL_SIZE, GRID_CELL_SIZE))
-                    if v > 0:
-                        if not settings['stuck_map']:
-                            pygame.draw.rect(screen, (tuple(map(lambda x: int(x * 255),
-                                                                colors[int((len(colors) - 1) * v)].rgb))), rect)
-                        else:
-                            pygame.gfxdraw.rectangle(screen, rect, (tuple(
-                                map(lambda x: int(x * 255),
-                                    colors[int((len(colors) - 1) * v)].rgb))))
-
-        if settings['stuck_map']:
-            for i in range(STUCK_MAP.shape[0]):
-                for j in range(STUCK_MAP.shape[1]):
-                    v = STUCK_MAP[i][j] / max_stuck_value
+        PREVIOUS_PASSENGERS = dict(zip(ids, PASSENGERS))
 
-                    rect = ((i * GRID_CELL_SIZE, j * GRID_CELL_SIZE),
-                            (GRID_CELL_SIZE, GRID_CELL_SIZE))
-                    if v > 0:
-                        pygame.draw.rect(screen, (tuple(map(lambda x: int(x * 255),
-                                                            colors[int((len(colors) - 1) * v)].rgb))), rect)
+        static_key = (settings['show_map'], settings['show_colliders'], settings['show_tile_map'])
+        renderer.begin(layers.get(
+            'background', (static_key, settings['density_map'], settings['stuck_map'], maps_version),
+            lambda: build_background(static_key)))
 
         """for vec in STUCK_VECTORS:
             c1, c2 = vec
@@ -230,11 +178,7 @@ def run_visualization(project_name, simulation_name):
                 pygame.draw.line(screen, (0, 0, 0), c2, ac2, 1)"""
 
         if settings['show_passengers']:
-            for x, y in PASSENGERS:
-                rect = ((x * GRID_CELL_SIZE, y * GRID_CELL_SIZE),
-                        (GRID_CELL_SIZE, GRID_CELL_SIZE))
-
-                pygame.draw.rect(screen, (0, 0, 255), rect)
+            renderer.mark(*draw_agents(screen, PASSENGERS, GRID_CELL_SIZE))
 
         pos = pygame.mouse.get_pos()
         pos = tuple(x // GRID_CELL_SIZE for x in pos)
@@ -247,12 +191,8 @@ def run_visualization(project_name, simulation_name):
 
         text_width, text_height = font.size(
             f"{int(clock.get_fps())} {pos} | Frame-N: {FRAME_N} | {('Baking ' + s[(FRAME_N % 10) // 3]) if not calculated['density_map'] else 'Baked!'}")
-        screen.blit(text_to_show, (SCREEN_SIZE[0] - text_width - 10, 10))
-
-        pygame.gfxdraw.rectangle(screen,
-                                 ((0, 0), (GRID_SIZE[0] * GRID_CELL_SIZE, GRID_SIZE[1] * GRID_CELL_SIZE)),
-                                 (0, 255, 255))
-        pygame.display.flip()
+        renderer.mark(screen.blit(text_to_show, (SCREEN_SIZE[0] - text_width - 10, 10)))
+        renderer.end()
         clock.tick(60)
 
     pygame.display.quit()